@@ -3,8 +3,6 @@ from django.contrib.admin import SimpleListFilter
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
 from django.db import models
 from django.utils.html import format_html
-from django.utils import timezone
-from django.db.models import Case, When, Value, IntegerField
 from django.http import HttpResponse
 from import_export import resources
 from import_export.formats import base_formats
@@ -12,7 +10,7 @@ from unfold.contrib.forms.widgets import WysiwygWidget
 
 from .models import User, Category, SubCategory, Service, ServiceImage, ExecutorReview, Vacancy, VacancyImage, \
     ClientReview, BoostPayment, Order, OTP_table, Chat_table, ChatRoom, Message, Ad, Boost, ServiceBoost, VacancyBoost, \
-    OrderReview
+    OrderReview, NotificationOutbox, ChatMembership
 import logging
 
 from .forms import CustomUserCreationForm
@@ -305,11 +303,6 @@ class CategoryAdmin(ModelAdmin):
     )
     actions = [export_to_excel]
 
-    def service_count(self, obj):
-        return obj.services.count()
-
-    service_count.short_description = 'Services'
-
     export_to_excel.short_description = "Export selected to Excel"
 
 
@@ -338,6 +331,7 @@ class ServiceAdmin(ModelAdmin):
     search_fields = ('title', 'description')
     inlines = [OrderServiceInline]
     list_editable = ('moderation',)
+    ordering = ('-boost_priority', '-id')
     filter_horizontal = ('sub_categories',)
     filter_vertical = ('sub_categories',)
     fieldsets = (
@@ -347,28 +341,6 @@ class ServiceAdmin(ModelAdmin):
     )
     actions = [export_to_excel]
 
-    def get_queryset(self, request):
-        queryset = super().get_queryset(request)
-        current_time = timezone.now()
-        return queryset.annotate(
-            boost_priority=Case(
-                When(
-                    boost__boost_type='Turbo',
-                    boosts__is_active=True,
-                    boosts__end_date__gt=current_time,
-                    then=Value(2)
-                ),
-                When(
-                    boost__boost_type='Top',
-                    boosts__is_active=True,
-                    boosts__end_date__gt=current_time,
-                    then=Value(1)
-                ),
-                default=Value(0),
-                output_field=IntegerField()
-            )
-        ).order_by('-boost_priority')
-
     def boost_priority_display(self, obj):
         priority = obj.boost_priority
         return "Turbo (2)" if priority == 2 else "Top (1)" if priority == 1 else "None (0)"
@@ -421,6 +393,7 @@ class VacancyAdmin(ModelAdmin):
     search_fields = ('title', 'description')
     inlines = [OrderVacancyInline]
     list_editable = ('moderation',)
+    ordering = ('-boost_priority', '-id')
 
     formfield_overrides = {
         models.TextField: {
@@ -435,28 +408,6 @@ class VacancyAdmin(ModelAdmin):
     )
     actions = [export_to_excel]
 
-    def get_queryset(self, request):
-        queryset = super().get_queryset(request)
-        current_time = timezone.now()
-        return queryset.annotate(
-            boost_priority=Case(
-                When(
-                    boost__boost_type='Turbo',
-                    boosts__is_active=True,
-                    boosts__end_date__gt=current_time,
-                    then=Value(2)
-                ),
-                When(
-                    boost__boost_type='Top',
-                    boosts__is_active=True,
-                    boosts__end_date__gt=current_time,
-                    then=Value(1)
-                ),
-                default=Value(0),
-                output_field=IntegerField()
-            )
-        ).order_by('-boost_priority')
-
     def boost_priority_display(self, obj):
         priority = obj.boost_priority
         return "Turbo (2)" if priority == 2 else "Top (1)" if priority == 1 else "None (0)"
@@ -630,11 +581,19 @@ class MessageAdmin(ModelAdmin):
     export_to_excel.short_description = "Export selected to Excel"
 
 
+# Custom admin for ChatMembership
+@admin.register(ChatMembership)
+class ChatMembershipAdmin(ModelAdmin):
+    list_display = ('room', 'user', 'last_read_message_id', 'updated_at')
+    search_fields = ('room__name', 'user__name', 'user__phone')
+    readonly_fields = ('updated_at',)
+
+
 # Custom admin for Ad
 @admin.register(Ad)
 class AdAdmin(ModelAdmin):
     list_display = ('id', 'image_preview', 'start_date', 'end_date', 'region', 'link')
-    list_filter = ('start_date', 'end_date')
+    list_filter = ('start_date', 'end_date', 'regions__region')
     search_fields = ('region', 'link')
     fieldsets = (
         (None, {
@@ -791,4 +750,17 @@ class VacancyBoostAdmin(ModelAdmin):
     readonly_fields = ('start_date',)
     actions = [export_to_excel]
 
-    export_to_excel.short_description = "Export selected to Excel"
\ No newline at end of file
+    export_to_excel.short_description = "Export selected to Excel"
+
+
+# Custom admin for NotificationOutbox
+@admin.register(NotificationOutbox)
+class NotificationOutboxAdmin(ModelAdmin):
+    list_display = ('id', 'kind', 'status', 'attempts', 'next_attempt_at', 'created_at')
+    list_filter = ('kind', 'status')
+    readonly_fields = ('kind', 'payload', 'attempts', 'last_error', 'created_at')
+    fieldsets = (
+        (None, {
+            'fields': ('kind', 'payload', 'status', 'attempts', 'next_attempt_at', 'last_error', 'created_at')
+        }),
+    )
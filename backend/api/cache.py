@@ -0,0 +1,35 @@
+import hashlib
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+CATALOG_CACHE_TIMEOUT = getattr(settings, "CATALOG_CACHE_TIMEOUT", 300)
+
+
+def _version_key(namespace):
+    return f"catalog:{namespace}:version"
+
+
+# Versions expire with the cached responses: with a per-process cache a bump made
+# elsewhere cannot reach this process, so a version (and its ETag) must not outlive them
+def get_catalog_version(namespace):
+    return cache.get_or_set(_version_key(namespace), lambda: uuid.uuid4().hex[:12], CATALOG_CACHE_TIMEOUT)
+
+
+def bump_catalog_version(*namespaces):
+    """
+    Invalidate every cached response of the given namespaces once the current
+    transaction commits, so readers never cache pre-commit data under the new version.
+    """
+    def bump():
+        for namespace in namespaces:
+            cache.set(_version_key(namespace), uuid.uuid4().hex[:12], CATALOG_CACHE_TIMEOUT)
+
+    transaction.on_commit(bump)
+
+
+def catalog_cache_key(namespace, version, url):
+    digest = hashlib.md5(url.encode()).hexdigest()
+    return f"catalog:{namespace}:{version}:{digest}", f'"{version}-{digest}"'
@@ -1,47 +1,139 @@
+import asyncio
 import json
+from asgiref.sync import sync_to_async
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
-from .models import ChatRoom, Message, User
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from rest_framework.exceptions import NotFound
+from .models import ChatRoom, ChatMembership, Message
+from .pagination import ChatHistoryPagination
+from .serializers import MessageSerializer
+from .services.chat_upload import ChunkedUpload, UploadError
 from django.core.files.base import ContentFile
 import base64
 
+
+class MessageCoalescer:
+    """
+    Collects messages saved by all consumers of this process within `delay`
+    seconds and writes them with a single bulk_create.
+    """
+
+    def __init__(self, delay):
+        self.delay = delay
+        self.pending = []
+        self.flush_task = None
+
+    async def add(self, message):
+        future = asyncio.get_running_loop().create_future()
+        self.pending.append((message, future))
+        if self.flush_task is None:
+            self.flush_task = asyncio.ensure_future(self.flush_later())
+        return await future
+
+    @staticmethod
+    def save_batch(messages):
+        # bulk_create skips post_save, so the rooms' last message is recorded here
+        with transaction.atomic():
+            Message.objects.bulk_create(messages)
+            latest = {}
+            for message in messages:
+                latest[message.room_id] = message
+            for message in latest.values():
+                ChatRoom.record_last_message(message)
+
+    async def flush_later(self):
+        await asyncio.sleep(self.delay)
+        batch, self.pending, self.flush_task = self.pending, [], None
+        try:
+            await database_sync_to_async(self.save_batch)([message for message, _ in batch])
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+        else:
+            for message, future in batch:
+                if not future.done():
+                    future.set_result(message)
+
+
+_coalescer = None
+
+
+def get_coalescer():
+    global _coalescer
+    delay_ms = getattr(settings, 'CHAT_WRITE_COALESCE_MS', 0)
+    if not delay_ms:
+        return None
+    if _coalescer is None:
+        _coalescer = MessageCoalescer(delay_ms / 1000)
+    return _coalescer
+
+
 class ChatConsumer(AsyncWebsocketConsumer):
     async def connect(self):
-        self.room_name = self.scope['url_route']['kwargs']['room_name']
-        self.room_group_name = f'chat_{self.room_name}'
-        self.user = self.scope['user']  # Provided by AuthMiddlewareStack
+        kwargs = self.scope['url_route']['kwargs']
+        self.room_name = kwargs.get('room_name')
+        self.user = self.scope['user']  # Provided by JWTAuthMiddleware
+        self.room_group_name = None
+        self.is_participant = False
+        self.upload = None
+        self.upload_tasks = set()
 
-        # if self.user.is_anonymous:
-        #     await self.close()
-        #     return
+        if self.user.is_anonymous:
+            await self.close()
+            return
 
-        await self.ensure_room_exists()
+        # Resolved once per connection and reused for every message
+        if 'user_id' in kwargs:
+            try:
+                self.room = await database_sync_to_async(ChatRoom.get_direct)(self.user.id, kwargs['user_id'])
+            except (TypeError, ValueError, IntegrityError):
+                # Anonymous, same user on both ends, or the other user does not exist
+                await self.close()
+                return
+            self.is_participant = True
+        else:
+            self.room = await self.ensure_room_exists()
+            # Anyone may join a named room, but only its participants see the history, as over REST
+            self.is_participant = await ChatRoom.for_user(self.user).filter(pk=self.room.pk).aexists()
+        self.room_group_name = self.room.group_name
         await self.channel_layer.group_add(self.room_group_name, self.channel_name)
-        await self.accept()
+        await self.accept(self.scope.get('jwt_subprotocol'))
 
     async def disconnect(self, close_code):
-        await self.channel_layer.group_discard(self.room_group_name, self.channel_name)
+        # Partial uploads stay on disk so the client can resume them after reconnecting
+        if self.upload is not None:
+            self.upload.release()
+        if self.upload_tasks:
+            await asyncio.gather(*self.upload_tasks, return_exceptions=True)
+        if self.room_group_name:
+            await self.channel_layer.group_discard(self.room_group_name, self.channel_name)
 
     async def receive(self, text_data=None, bytes_data=None):
-        if text_data:
+        if bytes_data is not None:
+            await self.receive_chunk(bytes_data)
+        elif text_data:
             text_data_json = json.loads(text_data)
             message_type = text_data_json.get('type', 'message')
 
             if message_type == 'message':
                 message = text_data_json['message']
-                await self.save_message(self.user.id, message)
+                saved = await self.save_message(message)
                 await self.channel_layer.group_send(
                     self.room_group_name,
                     {
                         'type': 'chat_message',
                         'message': f"{self.user.name}: {message}",
-                        'sender_id': self.user.id
+                        'sender_id': self.user.id,
+                        'message_id': saved.id,
                     }
                 )
             elif message_type == 'file':
                 file_data = text_data_json['file_data']
                 file_name = text_data_json['file_name']
-                await self.save_file_message(self.user.id, file_data, file_name)
+                await self.save_file_message(file_data, file_name)
                 await self.channel_layer.group_send(
                     self.room_group_name,
                     {
@@ -50,43 +142,148 @@ class ChatConsumer(AsyncWebsocketConsumer):
                         'sender_id': self.user.id
                     }
                 )
+            elif message_type == 'file_start':
+                await self.start_upload(text_data_json)
+            elif message_type == 'load_older':
+                await self.send_history(text_data_json.get('cursor'), text_data_json.get('limit'))
+            elif message_type == 'read':
+                await self.mark_read(text_data_json.get('message_id'))
+
+    async def start_upload(self, data):
+        """
+        Begin (or resume, when `upload_id` is given) a chunked upload. The client then
+        sends the file as binary frames starting at the returned offset; text frames
+        may be interleaved with the chunks.
+        """
+        if self.upload is not None:
+            self.upload.release()
+            self.upload = None
+        try:
+            self.upload = await database_sync_to_async(ChunkedUpload.start)(
+                self.user.id, self.room.id, data.get('file_name'), data.get('size'), data.get('upload_id')
+            )
+        except UploadError as e:
+            await self.send_upload_error(str(e))
+            return
+        await self.send(text_data=json.dumps({
+            'type': 'file_ready',
+            'upload_id': self.upload.upload_id,
+            'offset': self.upload.offset,
+        }))
+
+    async def receive_chunk(self, chunk):
+        upload = self.upload
+        if upload is None:
+            await self.send_upload_error('Нет активной загрузки')
+            return
+        try:
+            offset = await sync_to_async(upload.append, thread_sensitive=False)(chunk)
+        except UploadError as e:
+            await self.send_upload_error(str(e), upload.upload_id)
+            return
+        await self.send(text_data=json.dumps({'type': 'file_ack', 'upload_id': upload.upload_id, 'offset': offset}))
+        if upload.complete:
+            # Storing the file may be slow; don't hold up the next frames on this socket
+            self.upload = None
+            task = asyncio.ensure_future(self.finish_upload(upload))
+            self.upload_tasks.add(task)
+            task.add_done_callback(self.upload_tasks.discard)
+
+    async def finish_upload(self, upload):
+        message = await database_sync_to_async(upload.finish)()
+        await self.channel_layer.group_send(
+            self.room_group_name,
+            {
+                'type': 'file_message',
+                'file_name': upload.file_name,
+                'sender_id': self.user.id,
+                'message_id': message.id,
+            }
+        )
+
+    async def send_upload_error(self, error, upload_id=None):
+        await self.send(text_data=json.dumps({'type': 'file_error', 'upload_id': upload_id, 'error': error}))
+
+    async def send_history(self, cursor, limit):
+        """Reply with the page of messages older than `cursor` (newest first), as in the REST history."""
+        if not self.is_participant:
+            await self.send(text_data=json.dumps({'type': 'history_error', 'error': 'Нет доступа к истории чата'}))
+            return
+        try:
+            messages, next_cursor = await self.load_older(cursor, limit)
+        except NotFound as e:
+            await self.send(text_data=json.dumps({'type': 'history_error', 'error': str(e.detail)}))
+            return
+        await self.send(text_data=json.dumps({'type': 'history', 'messages': messages, 'next': next_cursor}))
+
+    @database_sync_to_async
+    def load_older(self, cursor, limit):
+        paginator = ChatHistoryPagination()
+        try:
+            page_size = max(1, min(int(limit), paginator.max_page_size))
+        except (TypeError, ValueError):
+            page_size = paginator.page_size
+        page = paginator.seek_page(self.room.messages.all(), cursor, page_size)
+        return MessageSerializer(page, many=True).data, paginator.get_next_cursor()
+
+    async def mark_read(self, message_id):
+        if not self.is_participant:
+            return
+        try:
+            message_id = int(message_id)
+        except (TypeError, ValueError):
+            return
+        if await database_sync_to_async(ChatMembership.mark_read)(self.room.id, self.user.id, message_id):
+            await self.channel_layer.group_send(
+                self.room_group_name,
+                {'type': 'read_receipt', 'user_id': self.user.id, 'last_read_message_id': message_id}
+            )
 
     async def chat_message(self, event):
         await self.send(text_data=json.dumps({
             'type': 'message',
             'message': event['message'],
-            'sender_id': event['sender_id']
+            'sender_id': event['sender_id'],
+            'message_id': event.get('message_id'),
+        }))
+
+    async def read_receipt(self, event):
+        await self.send(text_data=json.dumps({
+            'type': 'read',
+            'user_id': event['user_id'],
+            'last_read_message_id': event['last_read_message_id'],
         }))
 
     async def file_message(self, event):
         await self.send(text_data=json.dumps({
             'type': 'file',
             'file_name': event['file_name'],
-            'sender_id': event['sender_id']
+            'sender_id': event['sender_id'],
+            'message_id': event.get('message_id'),
         }))
 
     @database_sync_to_async
     def ensure_room_exists(self):
-        try:
-            ChatRoom.objects.get(name=self.room_name)
-        except ChatRoom.DoesNotExist:
-            ChatRoom.objects.create(
-                name=self.room_name,
-                user1=self.user,
-                user2=self.user  # Adjust for real user2 later
-            )
+        room, _ = ChatRoom.objects.get_or_create(
+            name=self.room_name,
+            defaults={
+                'user1_id': self.user.id,
+                'user2_id': self.user.id,  # Adjust for real user2 later
+            }
+        )
+        return room
 
-    @database_sync_to_async
-    def save_message(self, sender_id, content):
-        sender = User.objects.get(id=sender_id)
-        room = ChatRoom.objects.get(name=self.room_name)
-        Message.objects.create(room=room, sender=sender, content=content)
+    async def save_message(self, content):
+        message = Message(room=self.room, sender_id=self.user.id, content=content)
+        coalescer = get_coalescer()
+        if coalescer:
+            return await coalescer.add(message)
+        await database_sync_to_async(message.save)()
+        return message
 
     @database_sync_to_async
-    def save_file_message(self, sender_id, file_data, file_name):
-        sender = User.objects.get(id=sender_id)
-        room = ChatRoom.objects.get(name=self.room_name)
+    def save_file_message(self, file_data, file_name):
         format, filestr = file_data.split(';base64,')
         ext = format.split('/')[-1]
         data = ContentFile(base64.b64decode(filestr), name=f"{file_name}.{ext}")
-        Message.objects.create(room=room, sender=sender, file=data)
+        return Message.objects.create(room=self.room, sender_id=self.user.id, file=data)
@@ -0,0 +1,34 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from api.services.vacancy_notification import NotificationDelivery
+
+
+class Command(BaseCommand):
+    help = "Send queued bot notifications from the notification outbox."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--loop",
+            action="store_true",
+            help="Keep draining the outbox, sleeping --interval seconds when it is empty.",
+        )
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=1.0,
+            help="Seconds to sleep between polls of an empty outbox in --loop mode (default: 1).",
+        )
+
+    def handle(self, *args, **options):
+        delivery = NotificationDelivery()
+        while True:
+            stats = delivery.deliver_batch()
+            if not options["loop"]:
+                self.stdout.write(
+                    f"Sent {stats['sent']}, failed {stats['failed']}, deferred {stats['deferred']}"
+                )
+                break
+            if not any(stats.values()):
+                time.sleep(options["interval"])
@@ -0,0 +1,33 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from api.services.boost_service import BoostService
+
+
+class Command(BaseCommand):
+    help = "Deactivate overdue service and vacancy boosts and refresh their ranking priority."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--loop",
+            action="store_true",
+            help="Keep running and expire boosts every --interval seconds.",
+        )
+        parser.add_argument(
+            "--interval",
+            type=int,
+            default=60,
+            help="Seconds between runs in --loop mode (default: 60).",
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            stats = BoostService.expire_overdue()
+            self.stdout.write(
+                f"Expired {stats['services']} service boosts, {stats['vacancies']} vacancy boosts "
+                f"in {stats['duration_ms']} ms"
+            )
+            if not options["loop"]:
+                break
+            time.sleep(options["interval"])
@@ -0,0 +1,43 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from api.search.signals import flush_search_queue
+
+
+class Command(BaseCommand):
+    help = "Bulk-index objects queued by the search signal processor."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--loop",
+            action="store_true",
+            help="Keep flushing the queue, sleeping --interval seconds when nothing is due.",
+        )
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=1.0,
+            help="Seconds to sleep between polls of an empty queue in --loop mode (default: 1).",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=500,
+            help="Objects indexed per bulk request (default: 500).",
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            try:
+                flushed = flush_search_queue(batch_size=options["batch_size"])
+            except Exception as e:
+                if not options["loop"]:
+                    raise
+                self.stderr.write(f"Search index flush failed: {e}")
+                flushed = 0
+            if not options["loop"]:
+                self.stdout.write(f"Indexed {flushed} objects")
+                break
+            if not flushed:
+                time.sleep(options["interval"])
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from api.models import User
+
+
+class Command(BaseCommand):
+    help = "Rebuild executor/client rating sums, counts and averages from the review tables."
+
+    def handle(self, *args, **options):
+        updated = User.recompute_ratings()
+        self.stdout.write(f"Recomputed ratings for {updated} users")
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from api.models import Category
+
+
+class Command(BaseCommand):
+    help = "Recompute Category.service_count from approved services in one grouped query."
+
+    def handle(self, *args, **options):
+        updated = Category.recount_services()
+        self.stdout.write(f"Recounted services for {updated} categories")
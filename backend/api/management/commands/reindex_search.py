@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand, CommandError
+from django_elasticsearch_dsl.registries import registry
+
+from api.search.reindex import Reindexer
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuild search indices into versioned indices and swap their aliases atomically. "
+        "Indices whose mapping has not changed are skipped."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "indices",
+            nargs="*",
+            help="Index (alias) names to rebuild, e.g. services vacancies (default: all).",
+        )
+        parser.add_argument("--force", action="store_true", help="Rebuild even if the mapping is unchanged.")
+        parser.add_argument("--keep-old", action="store_true", help="Do not delete the replaced indices.")
+        parser.add_argument("--chunk-size", type=int, default=1000, help="Rows per cursor fetch and bulk request.")
+        parser.add_argument("--threads", type=int, default=4, help="Parallel bulk requests (default: 4).")
+
+    def handle(self, *args, **options):
+        documents = {doc._index._name: doc for doc in registry.get_documents()}
+        unknown = set(options["indices"]) - set(documents)
+        if unknown:
+            raise CommandError(f"Unknown indices: {', '.join(sorted(unknown))}")
+        selected = [documents[name] for name in options["indices"]] or None
+
+        reindexer = Reindexer(chunk_size=options["chunk_size"], thread_count=options["threads"], stdout=self.stdout)
+        reindexer.run(selected, force=options["force"], keep_old=options["keep_old"])
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from api.models import Ad
+
+
+class Command(BaseCommand):
+    help = "Rebuild the structured AdRegion rows from each ad's comma-separated region text."
+
+    def handle(self, *args, **options):
+        ads = Ad.objects.all()
+        for ad in ads.iterator():
+            ad.sync_regions()
+            unknown = ad.unknown_regions()
+            if unknown:
+                self.stderr.write(f"Ad {ad.pk}: unknown regions ignored: {', '.join(unknown)}")
+        self.stdout.write(f"Synced regions for {ads.count()} ads")
@@ -0,0 +1,80 @@
+from urllib.parse import parse_qs
+
+from channels.db import database_sync_to_async
+from channels.middleware import BaseMiddleware
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.utils.functional import cached_property
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.models import TokenUser
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import AccessToken
+
+from api.models import User
+
+
+class ChatTokenUser(TokenUser):
+    """User built from access token claims; `name` comes from the token or the user cache."""
+
+    @cached_property
+    def id(self) -> int:
+        return int(self.token[api_settings.USER_ID_CLAIM])
+
+
+class JWTAuthMiddleware(BaseMiddleware):
+    """
+    Authenticates websocket connections with the same SimpleJWT access tokens as
+    the REST API, without touching sessions.
+
+    The token is read from the `token` query parameter or from the subprotocols
+    `["Bearer", "<token>"]`. With CHAT_JWT_USER_CACHE_TTL set, the user's name is
+    also loaded once per TTL, and deleted users are refused even while their
+    token is still valid.
+    """
+    subprotocol = 'Bearer'
+    cache_prefix = 'ws:user:'
+
+    async def __call__(self, scope, receive, send):
+        scope = dict(scope)
+        raw_token = self.get_raw_token(scope)
+        scope['user'] = await self.get_user(raw_token) if raw_token else AnonymousUser()
+        return await super().__call__(scope, receive, send)
+
+    def get_raw_token(self, scope):
+        subprotocols = scope.get('subprotocols') or []
+        if self.subprotocol in subprotocols:
+            index = subprotocols.index(self.subprotocol)
+            if index + 1 < len(subprotocols):
+                # The consumer must echo the chosen subprotocol back on accept
+                scope['jwt_subprotocol'] = self.subprotocol
+                return subprotocols[index + 1]
+        query = parse_qs(scope.get('query_string', b'').decode())
+        return query.get('token', [None])[0]
+
+    async def get_user(self, raw_token):
+        try:
+            user = ChatTokenUser(AccessToken(raw_token))
+            user_id = user.id
+        except (TokenError, KeyError, TypeError, ValueError):
+            return AnonymousUser()
+
+        if settings.CHAT_JWT_USER_CACHE_TTL:
+            snapshot = await self.get_snapshot(user_id)
+            if not snapshot['exists']:
+                return AnonymousUser()
+            user.name = snapshot['name']
+        return user
+
+    async def get_snapshot(self, user_id):
+        key = f'{self.cache_prefix}{user_id}'
+        snapshot = await cache.aget(key)
+        if snapshot is None:
+            snapshot = await database_sync_to_async(self.load_snapshot)(user_id)
+            await cache.aset(key, snapshot, settings.CHAT_JWT_USER_CACHE_TTL)
+        return snapshot
+
+    @staticmethod
+    def load_snapshot(user_id):
+        row = User.objects.filter(pk=user_id).values('name').first()
+        return {'name': row['name'], 'exists': True} if row else {'name': None, 'exists': False}
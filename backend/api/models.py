@@ -1,3 +1,4 @@
+import os
 import uuid
 
 from datetime import timedelta
@@ -6,17 +7,52 @@ from decimal import Decimal
 from django.contrib.auth.base_user import AbstractBaseUser
 from django.contrib.auth.models import PermissionsMixin
 from django.utils import timezone
+from django.core.exceptions import ValidationError
 from django.core.validators import MinValueValidator, MaxValueValidator
-from django.db import models
+from django.db import models, transaction
+from django.db.models import (
+    Case, When, Value, IntegerField, FloatField, OuterRef, Subquery, Count, Sum, F, ExpressionWrapper, Q, Exists
+)
+from django.db.models.functions import Coalesce
 from phonenumber_field.modelfields import PhoneNumberField
 from django.conf import settings
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete, pre_save
 from django.dispatch import receiver
 from django.contrib.auth.models import BaseUserManager
 
+from .cache import bump_catalog_version
+
 def get_default_end_date():
     return timezone.now() + timedelta(days=7)
 
+def refresh_boost_priority(model, boost_model, target_field, ids=None):
+    """
+    Recompute the stored `boost_priority` of `model` rows from their active boosts.
+
+    Runs as a single UPDATE with a correlated subquery; `ids` limits it to the given rows.
+    """
+    now = timezone.now()
+    active_priority = boost_model.objects.filter(
+        **{target_field: OuterRef('pk')},
+        is_active=True,
+        end_date__gt=now,
+    ).annotate(
+        priority=Case(
+            *[When(boost__boost_type=boost_type, then=Value(priority))
+              for boost_type, priority in Boost.PRIORITIES.items()],
+            default=Value(0),
+            output_field=IntegerField(),
+        )
+    ).order_by('-priority').values('priority')[:1]
+
+    queryset = model.objects.all()
+    if ids is not None:
+        queryset = queryset.filter(pk__in=ids)
+    updated = queryset.update(boost_priority=Coalesce(Subquery(active_priority), Value(0)))
+    # The UPDATE sends no signals, so the search documents are queued here
+    SearchIndexQueue.enqueue_ids(model, queryset.values_list('pk', flat=True))
+    return updated
+
 class UserManager(BaseUserManager):
     def create_user(self, phone, email=None, password=None, **extra_fields):
         if not phone:
@@ -92,6 +128,11 @@ class User(AbstractBaseUser, PermissionsMixin):
         default=0.0,
         validators=[MinValueValidator(0.0), MaxValueValidator(5.0)]
     )
+    # Running totals behind executor_rating / client_rating, kept by the review signals
+    executor_rating_sum = models.FloatField(default=0.0, editable=False)
+    executor_rating_count = models.PositiveIntegerField(default=0, editable=False)
+    client_rating_sum = models.FloatField(default=0.0, editable=False)
+    client_rating_count = models.PositiveIntegerField(default=0, editable=False)
     avatar = models.ImageField(upload_to='avatars/', null=True, blank=True)
     birthday = models.DateField(null=True, blank=True)
     lang = models.CharField(
@@ -136,21 +177,54 @@ class User(AbstractBaseUser, PermissionsMixin):
         return self.orders_count > 3
 
     def update_ratings(self):
-        # Calculate average executor rating
-        executor_reviews = self.executor_reviews_as_executor.all()
-        if executor_reviews.exists():
-            self.executor_rating = executor_reviews.aggregate(avg_rating=models.Avg('rating'))['avg_rating'] or 0.0
-        else:
-            self.executor_rating = 0.0
-
-        # Calculate average client rating
-        client_reviews = self.client_reviews_as_client.all()
-        if client_reviews.exists():
-            self.client_rating = client_reviews.aggregate(avg_rating=models.Avg('rating'))['avg_rating'] or 0.0
-        else:
-            self.client_rating = 0.0
-
-        self.save()
+        User.recompute_ratings([self.pk])
+        self.refresh_from_db(fields=[
+            'executor_rating', 'executor_rating_sum', 'executor_rating_count',
+            'client_rating', 'client_rating_sum', 'client_rating_count',
+        ])
+
+    @staticmethod
+    def rating_delta(role, rating, delta=1):
+        """
+        UPDATE kwargs adding (`delta=1`) or removing (`delta=-1`) one `role` rating.
+
+        All expressions read the pre-update row, so the average is computed from the
+        new sum and count in the same statement.
+        """
+        sum_field, count_field = f'{role}_rating_sum', f'{role}_rating_count'
+        new_sum = F(sum_field) + rating * delta
+        new_count = F(count_field) + delta
+        return {
+            sum_field: new_sum,
+            count_field: new_count,
+            f'{role}_rating': Case(
+                When(**{f'{count_field}__gt': -delta}, then=ExpressionWrapper(new_sum / new_count, output_field=FloatField())),
+                default=Value(0.0),
+                output_field=FloatField(),
+            ),
+        }
+
+    @staticmethod
+    def recompute_ratings(user_ids=None):
+        """Rebuild rating sums, counts and averages from the review tables in one UPDATE."""
+        values = {}
+        for role, review_model in (('executor', ExecutorReview), ('client', ClientReview)):
+            reviews = review_model.objects.filter(**{role: OuterRef('pk')}).order_by().values(role)
+            values[f'{role}_rating_sum'] = Coalesce(
+                Subquery(reviews.annotate(total=Sum('rating')).values('total')), Value(0.0)
+            )
+            values[f'{role}_rating_count'] = Coalesce(
+                Subquery(reviews.annotate(total=Count('id')).values('total')), Value(0)
+            )
+            values[f'{role}_rating'] = Coalesce(
+                Subquery(reviews.annotate(average=models.Avg('rating')).values('average')),
+                Value(0.0),
+            )
+
+        queryset = User.objects.all()
+        if user_ids is not None:
+            queryset = queryset.filter(pk__in=user_ids)
+        return queryset.update(**values)
 
     def created_by_display(self):
         if self.created_by:
@@ -173,6 +247,9 @@ class OTP_table(models.Model):
         db_table = 'otp_table'
         verbose_name = "OTP таблица"
         verbose_name_plural = "OTP таблицы"
+        indexes = [
+            models.Index(fields=['phone', 'created_at'], name='otp_phone_created_idx'),
+        ]
 
     def __str__(self):
         return f"Code {self.code} for {self.phone}"
@@ -191,6 +268,17 @@ class Category(models.Model):
     def __str__(self):
         return self.title
 
+    @staticmethod
+    def recount_services():
+        """Recompute `service_count` for every category in one UPDATE."""
+        approved = Service.objects.filter(
+            category=OuterRef('pk'),
+            moderation=Service.COUNTED_MODERATION,
+        ).order_by().values('category').annotate(total=Count('id')).values('total')
+        updated = Category.objects.update(service_count=Coalesce(Subquery(approved), Value(0)))
+        bump_catalog_version('categories')
+        return updated
+
 class SubCategory(models.Model):
     title = models.CharField(max_length=255)
     display_ru = models.CharField(max_length=255, blank=True, null=True)
@@ -211,6 +299,9 @@ class Service(models.Model):
         ('Approved', 'Approved'),
         ('Rejected', 'Rejected'),
     )
+    # Only approved services are included in Category.service_count
+    COUNTED_MODERATION = 'Approved'
+
     title = models.CharField(max_length=255)
     description = models.TextField()
     category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='services')
@@ -219,15 +310,30 @@ class Service(models.Model):
     executor = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='services')
     moderation = models.CharField(max_length=20, choices=MODERATION_CHOICES, default='Pending', null=True, blank=True)
     boost = models.ForeignKey('Boost', on_delete=models.CASCADE, null=True, blank=True)
+    boost_priority = models.PositiveSmallIntegerField(default=0, editable=False)
 
     class Meta:
         db_table = 'services'
         verbose_name = "Сервис"
         verbose_name_plural = "Сервисы"
+        indexes = [
+            models.Index(fields=['price', 'id'], name='services_price_id_idx'),
+            models.Index(fields=['moderation', 'boost_priority', 'id'], name='services_ranked_idx'),
+        ]
 
     def __str__(self):
         return self.title
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        if 'category_id' in instance.__dict__ and 'moderation' in instance.__dict__:
+            instance._counted_category_id = instance.counted_category_id()
+        return instance
+
+    def counted_category_id(self):
+        return self.category_id if self.moderation == self.COUNTED_MODERATION else None
+
 class ServiceImage(models.Model):
     service = models.ForeignKey(Service, on_delete=models.CASCADE, related_name='images')
     image = models.ImageField(upload_to='services/')
@@ -261,10 +367,16 @@ class Vacancy(models.Model):
         default='pending',
         verbose_name="Модерация"
     )
+    boost_priority = models.PositiveSmallIntegerField(default=0, editable=False, verbose_name="Приоритет буста")
+
     class Meta:
         db_table = 'vacancies'
         verbose_name = "Вакансия"
         verbose_name_plural = "Вакансии"
+        indexes = [
+            models.Index(fields=['price', 'id'], name='vacancies_price_id_idx'),
+            models.Index(fields=['moderation', 'boost_priority', 'id'], name='vacancies_ranked_idx'),
+        ]
 
     def __str__(self):
         return self.title
@@ -301,6 +413,11 @@ class ExecutorReview(models.Model):
         verbose_name_plural = "Отзывы о исполнителях"
         unique_together = ('order', 'client')
 
+    def save(self, *args, **kwargs):
+        # Keeps the review insert and the executor's rating totals in one transaction
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
 class ClientReview(models.Model):
     order = models.ForeignKey('Order', on_delete=models.CASCADE, related_name='client_reviews')
     executor = models.ForeignKey(
@@ -326,6 +443,11 @@ class ClientReview(models.Model):
         verbose_name_plural = "Отзывы клиентов"
         unique_together = ('order', 'executor')  # Prevent multiple reviews by the same executor for an order
 
+    def save(self, *args, **kwargs):
+        # Keeps the review insert and the client's rating totals in one transaction
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
     def __str__(self):
         return f"Review by {self.executor} for client {self.client} on order {self.order.id}"
 
@@ -349,13 +471,91 @@ class ChatRoom(models.Model):
         blank=True
     )
 
+    # One-to-one rooms keep the pair ordered as (user1 < user2), see get_direct()
+    is_direct = models.BooleanField(default=False, editable=False)
+
+    # Copy of the newest message for the inbox, kept by record_last_message()
+    last_message_id = models.PositiveBigIntegerField(null=True, blank=True, editable=False)
+    last_message_preview = models.CharField(max_length=255, blank=True, default='', editable=False)
+    last_message_at = models.DateTimeField(null=True, blank=True, editable=False)
+    last_message_sender = models.ForeignKey(
+        settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True, editable=False, related_name='+'
+    )
+
     class Meta:
         verbose_name = "Комната чата"
         verbose_name_plural = "Комнаты чатов"
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user1', 'user2'], condition=Q(is_direct=True), name='chatroom_direct_pair_unique'
+            ),
+            models.CheckConstraint(
+                condition=Q(is_direct=False) | Q(user1__lt=F('user2')), name='chatroom_direct_pair_ordered'
+            ),
+        ]
 
     def __str__(self):
         return self.name or f"{self.user1} ↔ {self.user2}"
 
+    @property
+    def group_name(self):
+        return f'chat_room_{self.pk}'
+
+    @classmethod
+    def for_user(cls, user):
+        """Rooms the user takes part in, without the duplicate rows of a participants join."""
+        member = cls.participants.through.objects.filter(chatroom_id=OuterRef('pk'), user_id=user.id)
+        return cls.objects.filter(Q(user1_id=user.id) | Q(user2_id=user.id) | Exists(member))
+
+    @classmethod
+    def get_direct(cls, user_id, other_user_id):
+        """
+        The one room between two users. The lookup is a single probe of the unique
+        (user1, user2) index; when two connections create it at once, the loser of
+        the insert race gets the winner's row.
+        """
+        low, high = sorted((int(user_id), int(other_user_id)))
+        if low == high:
+            raise ValueError('A direct room needs two different users')
+        room, _ = cls.objects.get_or_create(is_direct=True, user1_id=low, user2_id=high)
+        return room
+
+    @classmethod
+    def inbox(cls, user):
+        """The user's rooms, newest conversation first, with `unread_count` computed in the same query."""
+        watermark = ChatMembership.objects.filter(
+            room_id=OuterRef(OuterRef('pk')), user_id=user.id
+        ).values('last_read_message_id')[:1]
+        unread = ChatMembership.unread_messages(
+            OuterRef('pk'), user.id, Coalesce(Subquery(watermark), Value(0))
+        ).order_by().values('room_id').annotate(count=Count('pk')).values('count')
+        return cls.for_user(user).select_related('user1', 'user2').annotate(
+            unread_count=Coalesce(Subquery(unread, output_field=IntegerField()), Value(0))
+        ).order_by(F('last_message_at').desc(nulls_last=True), '-id')
+
+    @classmethod
+    def record_last_message(cls, message):
+        """Point the room at `message` unless a newer one is already recorded."""
+        return cls.objects.filter(
+            Q(last_message_id__isnull=True) | Q(last_message_id__lt=message.id), pk=message.room_id
+        ).update(
+            last_message_id=message.id,
+            last_message_preview=message.preview,
+            last_message_at=message.timestamp,
+            last_message_sender_id=message.sender_id,
+        )
+
+    @classmethod
+    def refresh_last_message(cls, room_id):
+        latest = Message.objects.filter(room_id=room_id).order_by('-id').first()
+        if latest is None:
+            cls.objects.filter(pk=room_id).update(
+                last_message_id=None, last_message_preview='', last_message_at=None, last_message_sender=None
+            )
+        else:
+            cls.objects.filter(pk=room_id).update(last_message_id=None)
+            cls.record_last_message(latest)
+
 class Chat_table(models.Model):
     phone = PhoneNumberField(unique=True)
     user1 = models.ForeignKey(User, on_delete=models.CASCADE, related_name="chats_started")
@@ -422,19 +622,70 @@ class Ad(models.Model):
     start_date = models.DateTimeField(default=timezone.now, verbose_name="Start of Showing Ad")
     end_date = models.DateTimeField(default=get_default_end_date,
                                     verbose_name="End of Showing Ad")
-    region = models.CharField(max_length=500, null=True, blank=True, verbose_name="Regions (comma-separated)", help_text="Enter regions separated by commas, e.g., 'Region1, Region2'")
+    region = models.CharField(max_length=500, null=True, blank=True, verbose_name="Regions (comma-separated)", help_text="Enter regions separated by commas, e.g., 'Ташкентская область, Город Ташкент'. Leave empty to show everywhere.")
     link = models.URLField(max_length=2000, null=True, blank=True, verbose_name="Click Link", help_text="URL where the banner should redirect when clicked")
 
     class Meta:
         db_table = 'ads'
         verbose_name = "Реклама"
         verbose_name_plural = "Рекламы"
+        indexes = [
+            models.Index(fields=['end_date', 'start_date'], name='ads_window_idx'),
+        ]
 
     def __str__(self):
         return f"Ad from {self.start_date} to {self.end_date}"
 
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            self.sync_regions()
+
+    def clean(self):
+        # An ad whose names are all unknown would get no AdRegion rows and show everywhere
+        unknown = self.unknown_regions()
+        if unknown:
+            raise ValidationError({'region': f"Неизвестные регионы: {', '.join(unknown)}"})
+
+    def region_names(self):
+        return [part.strip() for part in (self.region or '').split(',') if part.strip()]
+
+    def unknown_regions(self):
+        known = {name.lower() for name, _ in User.REGIONS}
+        return [name for name in self.region_names() if name.lower() not in known]
+
+    def parse_regions(self):
+        known = {name.lower(): name for name, _ in User.REGIONS}
+        return {known[name.lower()] for name in self.region_names() if name.lower() in known}
+
+    def sync_regions(self):
+        """Rebuild the AdRegion rows from the comma-separated `region` text."""
+        regions = self.parse_regions()
+        self.regions.exclude(region__in=regions).delete()
+        existing = set(self.regions.values_list('region', flat=True))
+        AdRegion.objects.bulk_create([AdRegion(ad=self, region=region) for region in regions - existing])
+
+class AdRegion(models.Model):
+    ad = models.ForeignKey(Ad, on_delete=models.CASCADE, related_name='regions')
+    region = models.CharField(max_length=100, choices=User.REGIONS)
+
+    class Meta:
+        db_table = 'ad_regions'
+        verbose_name = "Регион рекламы"
+        verbose_name_plural = "Регионы рекламы"
+        unique_together = ('ad', 'region')
+        indexes = [
+            models.Index(fields=['region', 'ad'], name='ad_regions_region_idx'),
+        ]
+
+    def __str__(self):
+        return self.region
+
 # New Boost-related models
 class Boost(models.Model):
+    # Stored on Service/Vacancy.boost_priority; organic listings have 0
+    PRIORITIES = {'Top': 1, 'Turbo': 2}
+
     name = models.CharField(max_length=100, unique=True)  # e.g., "Top 1 Day", "Turbo 1 Week"
     boost_type = models.CharField(max_length=20, choices=[('Top', 'Top'), ('Turbo', 'Turbo')])
     duration_days = models.PositiveIntegerField()  # Duration in days (e.g., 1, 7, 14, 30)
@@ -468,6 +719,9 @@ class ServiceBoost(models.Model):
         verbose_name = "Буст сервиса"
         verbose_name_plural = "Бусты сервисов"
         ordering = ['-is_active', '-start_date']
+        indexes = [
+            models.Index(fields=['is_active', 'end_date'], name='service_boost_expiry_idx'),
+        ]
 
     def __str__(self):
         return f"Boost {self.service} ({self.boost.name}) до {self.end_date:%d.%m.%Y}"
@@ -480,7 +734,11 @@ class ServiceBoost(models.Model):
     def check_status(self):
         if self.is_active and timezone.now() > self.end_date:
             self.is_active = False
-            self.save()
+            self.save(update_fields=['is_active'])
+
+    @staticmethod
+    def refresh_priorities(service_ids=None):
+        return refresh_boost_priority(Service, ServiceBoost, 'service', service_ids)
 
 class VacancyBoost(models.Model):
     vacancy = models.ForeignKey('Vacancy', on_delete=models.CASCADE, related_name='boosts')
@@ -493,6 +751,9 @@ class VacancyBoost(models.Model):
         verbose_name = "Буст вакансии"
         verbose_name_plural = "Бусты вакансий"
         ordering = ['-is_active', '-start_date']
+        indexes = [
+            models.Index(fields=['is_active', 'end_date'], name='vacancy_boost_expiry_idx'),
+        ]
 
     def __str__(self):
         return f"Boost {self.vacancy} ({self.boost.name}) до {self.end_date:%d.%m.%Y}"
@@ -505,7 +766,11 @@ class VacancyBoost(models.Model):
     def check_status(self):
         if self.is_active and timezone.now() > self.end_date:
             self.is_active = False
-            self.save()
+            self.save(update_fields=['is_active'])
+
+    @staticmethod
+    def refresh_priorities(vacancy_ids=None):
+        return refresh_boost_priority(Vacancy, VacancyBoost, 'vacancy', vacancy_ids)
 
 class Message(models.Model):
     room = models.ForeignKey(ChatRoom, on_delete=models.CASCADE, related_name='messages')
@@ -513,21 +778,88 @@ class Message(models.Model):
     content = models.TextField(null=True,blank=True)
     file = models.FileField(upload_to='chat_files/', null=True, blank=True)
     timestamp = models.DateTimeField(auto_now_add=True)
-    is_read = models.BooleanField(default=False)
 
     class Meta:
         db_table = 'messages'
         ordering = ['timestamp']
+        indexes = [
+            # History pages seek by (timestamp, id) inside one room
+            models.Index(fields=['room', 'timestamp', 'id'], name='message_room_history_idx'),
+            # Unread counts are a range count above a read watermark; sender rides along
+            # so Postgres can answer them from the index alone
+            models.Index(fields=['room', 'id'], include=['sender'], name='message_room_unread_idx'),
+        ]
         verbose_name = "Сообщение"
         verbose_name_plural = "Сообщения"
 
     def __str__(self):
         return f"Message from {self.sender.name or self.sender.phone} in {self.room.name or 'ChatRoom ' + str(self.room.id)}"
 
-    def mark_as_read(self):
-        if not self.is_read:
-            self.is_read = True
-            self.save(update_fields=['is_read'])
+    @property
+    def preview(self):
+        if self.content:
+            return self.content[:ChatRoom._meta.get_field('last_message_preview').max_length]
+        return os.path.basename(self.file.name) if self.file else ''
+
+    def mark_as_read(self, user):
+        """Mark this and every earlier message in the room as read by `user`."""
+        return ChatMembership.mark_read(self.room_id, user.id, self.id)
+
+class ChatMembership(models.Model):
+    """
+    A participant's read watermark in a room: every message with an id up to
+    `last_read_message_id` counts as read, so reading a whole conversation is
+    one write instead of one per message.
+    """
+    room = models.ForeignKey(ChatRoom, on_delete=models.CASCADE, related_name='memberships')
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='chat_memberships')
+    last_read_message_id = models.PositiveBigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'chat_memberships'
+        constraints = [
+            models.UniqueConstraint(fields=['room', 'user'], name='chat_membership_unique'),
+        ]
+        verbose_name = "Участник чата"
+        verbose_name_plural = "Участники чатов"
+
+    def __str__(self):
+        return f"{self.user} in {self.room}: read up to {self.last_read_message_id}"
+
+    @classmethod
+    def mark_read(cls, room_id, user_id, message_id) -> bool:
+        """
+        Move the user's watermark forward to `message_id`. Returns False if the
+        message is not in the room or the watermark is already past it.
+        """
+        in_room = Exists(Message.objects.filter(room_id=room_id, pk=message_id))
+        updated = cls.objects.filter(
+            in_room, room_id=room_id, user_id=user_id, last_read_message_id__lt=message_id
+        ).update(last_read_message_id=message_id, updated_at=timezone.now())
+        if updated:
+            return True
+        if cls.objects.filter(room_id=room_id, user_id=user_id).exists():
+            return False
+        if not Message.objects.filter(room_id=room_id, pk=message_id).exists():
+            return False
+        _, created = cls.objects.get_or_create(
+            room_id=room_id, user_id=user_id, defaults={'last_read_message_id': message_id}
+        )
+        # Another connection may have created the row first; move its watermark instead
+        return created or cls.mark_read(room_id, user_id, message_id)
+
+    @staticmethod
+    def unread_messages(room_id, user_id, last_read_message_id=0):
+        """Messages from others above the watermark (a range on the (room, id) index)."""
+        return Message.objects.filter(room_id=room_id, id__gt=last_read_message_id).exclude(sender_id=user_id)
+
+    @classmethod
+    def unread_count(cls, room_id, user_id) -> int:
+        watermark = cls.objects.filter(room_id=room_id, user_id=user_id).values_list(
+            'last_read_message_id', flat=True
+        ).first() or 0
+        return cls.unread_messages(room_id, user_id, watermark).count()
 
 class BoostPayment(models.Model):
     amount = models.DecimalField(max_digits=10, decimal_places=2)
@@ -551,11 +883,202 @@ class BoostPayment(models.Model):
     def __str__(self):
         return f"Order #{self.id}"
 
+class NotificationOutbox(models.Model):
+    KIND_CHOICES = [
+        ('vacancy', 'Вакансия'),
+        ('service', 'Сервис'),
+    ]
+    STATUS_CHOICES = [
+        ('pending', 'В очереди'),
+        ('failed', 'Ошибка'),
+    ]
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    payload = models.JSONField()
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = 'notification_outbox'
+        verbose_name = "Уведомление в очереди"
+        verbose_name_plural = "Очередь уведомлений"
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at'], name='outbox_due_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} #{self.payload.get('id')} ({self.status})"
+
+class SearchIndexQueue(models.Model):
+    """
+    Objects whose search documents are out of date. Repeated saves of one object
+    collapse into one row whose `queued_at` moves to the latest change; the
+    flush_search_index worker turns it into a bulk index (or delete, if the
+    object is gone) once it has been quiet for SEARCH_INDEX_DEBOUNCE seconds.
+    """
+    model = models.CharField(max_length=100)  # app_label.model_name
+    object_id = models.BigIntegerField()
+    queued_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        db_table = 'search_index_queue'
+        verbose_name = "Объект на индексацию"
+        verbose_name_plural = "Очередь индексации"
+        constraints = [
+            models.UniqueConstraint(fields=['model', 'object_id'], name='search_queue_object_unique'),
+        ]
+        indexes = [
+            models.Index(fields=['queued_at'], name='search_queue_due_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.model} #{self.object_id}"
+
+    @classmethod
+    def enqueue(cls, instances):
+        cls.queue_keys((instance._meta.label_lower, instance.pk) for instance in instances)
+
+    @classmethod
+    def enqueue_ids(cls, model, ids):
+        """Queue `model` rows changed by a bulk UPDATE, which the signal processor never sees."""
+        if getattr(settings, 'ELASTICSEARCH_DSL_AUTOSYNC', True):
+            cls.queue_keys((model._meta.label_lower, pk) for pk in ids)
+
+    @classmethod
+    def queue_keys(cls, keys):
+        # An upsert cannot touch one row twice, so duplicates are dropped first
+        now = timezone.now()
+        rows = [cls(model=model, object_id=object_id, queued_at=now) for model, object_id in dict.fromkeys(keys)]
+        if rows:
+            cls.objects.bulk_create(
+                rows, update_conflicts=True, unique_fields=['model', 'object_id'], update_fields=['queued_at']
+            )
+
+class SearchReindexHold(models.Model):
+    """
+    A running reindex_search. While an unexpired row exists, the
+    flush_search_index worker leaves the queue alone, so changes land in the
+    new index after the alias swap instead of in the one being replaced.
+    Kept in the database because the two run in different containers.
+    """
+    started_at = models.DateTimeField(default=timezone.now)
+    expires_at = models.DateTimeField()
+
+    class Meta:
+        db_table = 'search_reindex_holds'
+        verbose_name = "Переиндексация поиска"
+        verbose_name_plural = "Переиндексации поиска"
+
+    def __str__(self):
+        return f"Переиндексация с {self.started_at:%d.%m.%Y %H:%M}"
+
+    @classmethod
+    def active(cls):
+        return cls.objects.filter(expires_at__gt=timezone.now()).exists()
+
+# Review model -> the rated role, which is also the field naming the rated user
+REVIEW_ROLES = {ExecutorReview: 'executor', ClientReview: 'client'}
+
+@receiver(pre_save, sender=ExecutorReview)
+@receiver(pre_save, sender=ClientReview)
+def remember_review_rating(sender, instance, **kwargs):
+    # An edit moves the rating from the stored (user, rating) to the new one
+    role = REVIEW_ROLES[sender]
+    instance._rated = None
+    if instance.pk:
+        instance._rated = sender.objects.filter(pk=instance.pk).values_list(f'{role}_id', 'rating').first()
+
 @receiver(post_save, sender=ExecutorReview)
 @receiver(post_save, sender=ClientReview)
 def update_user_ratings(sender, instance, created, **kwargs):
+    role = REVIEW_ROLES[sender]
+    rated = (getattr(instance, f'{role}_id'), instance.rating)
+    previous = None if created else getattr(instance, '_rated', None)
+    if previous == rated:
+        return
+    if previous:
+        User.objects.filter(pk=previous[0]).update(**User.rating_delta(role, previous[1], -1))
+        queue_rated_listings(sender, previous[0])
+    User.objects.filter(pk=rated[0]).update(**User.rating_delta(role, rated[1]))
+    queue_rated_listings(sender, rated[0])
+
+@receiver(post_delete, sender=ExecutorReview)
+@receiver(post_delete, sender=ClientReview)
+def remove_user_rating(sender, instance, **kwargs):
+    role = REVIEW_ROLES[sender]
+    user_id = getattr(instance, f'{role}_id')
+    User.objects.filter(pk=user_id).update(**User.rating_delta(role, instance.rating, -1))
+    queue_rated_listings(sender, user_id)
+
+def queue_rated_listings(sender, user_id):
+    # Search documents carry the owner's rating: services the executor's, vacancies the client's
+    if sender == ExecutorReview:
+        SearchIndexQueue.enqueue_ids(Service, Service.objects.filter(executor_id=user_id).values_list('pk', flat=True))
+    elif sender == ClientReview:
+        SearchIndexQueue.enqueue_ids(Vacancy, Vacancy.objects.filter(client_id=user_id).values_list('pk', flat=True))
+
+@receiver(post_save, sender=ServiceBoost)
+@receiver(post_delete, sender=ServiceBoost)
+def update_service_boost_priority(sender, instance, **kwargs):
+    ServiceBoost.refresh_priorities([instance.service_id])
+
+@receiver(post_save, sender=VacancyBoost)
+@receiver(post_delete, sender=VacancyBoost)
+def update_vacancy_boost_priority(sender, instance, **kwargs):
+    VacancyBoost.refresh_priorities([instance.vacancy_id])
+
+@receiver(post_save, sender=Service)
+def update_category_service_count(sender, instance, created, **kwargs):
+    if not created and not hasattr(instance, '_counted_category_id'):
+        # Loaded with deferred fields, the previous state is unknown; recount_services() fixes drift
+        return
+
+    old_category_id = None if created else instance._counted_category_id
+    new_category_id = instance.counted_category_id()
+    if old_category_id != new_category_id:
+        if old_category_id:
+            Category.objects.filter(pk=old_category_id).update(service_count=F('service_count') - 1)
+        if new_category_id:
+            Category.objects.filter(pk=new_category_id).update(service_count=F('service_count') + 1)
+        bump_catalog_version('categories')
+    instance._counted_category_id = new_category_id
+
+@receiver(post_delete, sender=Service)
+def decrement_category_service_count(sender, instance, **kwargs):
+    category_id = getattr(instance, '_counted_category_id', instance.counted_category_id())
+    if category_id:
+        Category.objects.filter(pk=category_id).update(service_count=F('service_count') - 1)
+        bump_catalog_version('categories')
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def invalidate_category_cache(sender, **kwargs):
+    # SubCategorySerializer renders the category title
+    bump_catalog_version('categories', 'subcategories')
+
+@receiver(post_save, sender=SubCategory)
+@receiver(post_delete, sender=SubCategory)
+def invalidate_subcategory_cache(sender, **kwargs):
+    bump_catalog_version('subcategories')
+
+@receiver(post_save, sender=Boost)
+@receiver(post_delete, sender=Boost)
+def invalidate_boost_cache(sender, **kwargs):
+    bump_catalog_version('boosts')
+
+@receiver(post_save, sender=Ad)
+@receiver(post_delete, sender=Ad)
+def invalidate_ad_cache(sender, **kwargs):
+    bump_catalog_version('ads')
+
+@receiver(post_save, sender=Message)
+def record_room_last_message(sender, instance, created, **kwargs):
     if created:
-        if sender == ExecutorReview:
-            instance.executor.update_ratings()
-        elif sender == ClientReview:
-            instance.client.update_ratings()
\ No newline at end of file
+        ChatRoom.record_last_message(instance)
+
+@receiver(post_delete, sender=Message)
+def forget_room_last_message(sender, instance, **kwargs):
+    if ChatRoom.objects.filter(pk=instance.room_id, last_message_id=instance.id).exists():
+        ChatRoom.refresh_last_message(instance.room_id)
@@ -0,0 +1,195 @@
+import base64
+import json
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Opt-in keyset pagination over a stable (sort_key, id) ordering.
+
+    Pagination is enabled only when the request carries `cursor` or `page_size`,
+    so existing clients keep getting the plain list. Each page seeks past the
+    last row of the previous one instead of using OFFSET, so page 1000 costs
+    the same as page 1 as long as the ordering is backed by a composite index.
+    """
+    page_size = 20
+    max_page_size = 100
+    opt_in = True
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    ordering_query_param = 'ordering'
+    invalid_cursor_message = 'Invalid cursor'
+
+    # The last field must always be a unique tie-breaker with the same direction
+    # as the sort key, so one composite index can be scanned in either direction.
+    orderings = {
+        '-id': ('-id',),
+        'id': ('id',),
+        'price': ('price', 'id'),
+        '-price': ('-price', '-id'),
+    }
+    default_ordering = '-id'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        params = request.query_params
+        if self.opt_in and self.cursor_query_param not in params and self.page_size_query_param not in params:
+            return None
+
+        self.request = request
+        return self.seek_page(
+            queryset,
+            params.get(self.cursor_query_param),
+            self.get_page_size(request),
+            view=view,
+            ordering_name=self.get_ordering_name(request, view),
+        )
+
+    def seek_page(self, queryset, encoded_cursor, page_size, view=None, ordering_name=None):
+        """Return the page after `encoded_cursor`. Needs no request, so consumers can use it too."""
+        self.page_size = page_size
+        self.ordering_name = ordering_name or getattr(view, 'keyset_default_ordering', self.default_ordering)
+        fields = self.get_orderings(view)[self.ordering_name]
+
+        cursor = self.decode_cursor(encoded_cursor)
+        if cursor is not None:
+            if cursor.get('o') != self.ordering_name:
+                raise NotFound(self.invalid_cursor_message)
+            values = self.cursor_values(queryset.model, fields, cursor['v'])
+            queryset = queryset.filter(self.seek(fields, values))
+
+        rows = list(queryset.order_by(*fields)[:self.page_size + 1])
+        self.has_next = len(rows) > self.page_size
+        self.page = rows[:self.page_size]
+        self.fields = fields
+        return self.page
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+    def get_orderings(self, view):
+        return getattr(view, 'keyset_orderings', self.orderings)
+
+    def get_ordering_name(self, request, view):
+        orderings = self.get_orderings(view)
+        name = request.query_params.get(self.ordering_query_param)
+        if name in orderings:
+            return name
+        return getattr(view, 'keyset_default_ordering', self.default_ordering)
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return max(1, min(size, self.max_page_size))
+
+    def get_next_cursor(self):
+        if not self.has_next:
+            return None
+        last = self.page[-1]
+        return self.encode_cursor([self._field_value(last, field.lstrip('-')) for field in self.fields])
+
+    def get_next_link(self):
+        cursor = self.get_next_cursor()
+        if cursor is None:
+            return None
+        url = self.request.build_absolute_uri()
+        url = replace_query_param(url, self.page_size_query_param, self.page_size)
+        return replace_query_param(url, self.cursor_query_param, cursor)
+
+    def cursor_values(self, model, fields, values):
+        """The cursor's values as the fields' Python types; anything else is an invalid cursor, not a 500."""
+        if len(values) != len(fields):
+            raise NotFound(self.invalid_cursor_message)
+        try:
+            values = [model._meta.get_field(field.lstrip('-')).to_python(value) for field, value in zip(fields, values)]
+        except (TypeError, ValueError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+        if None in values:
+            raise NotFound(self.invalid_cursor_message)
+        return values
+
+    def seek(self, fields, values):
+        """
+        Build the lexicographic "after this row" condition for `fields`.
+
+        The leading `>=` / `<=` on the first sort key is redundant logically, but it
+        gives Postgres a range start for the composite index scan.
+        """
+        if len(values) != len(fields):
+            raise NotFound(self.invalid_cursor_message)
+
+        condition = None
+        for field, value in reversed(list(zip(fields, values))):
+            name = field.lstrip('-')
+            strict = Q(**{f"{name}__{'lt' if field.startswith('-') else 'gt'}": value})
+            condition = strict if condition is None else strict | (Q(**{name: value}) & condition)
+
+        first_field, first_value = fields[0], values[0]
+        first_name = first_field.lstrip('-')
+        lookup = 'lte' if first_field.startswith('-') else 'gte'
+        return Q(**{f'{first_name}__{lookup}': first_value}) & condition
+
+    def encode_cursor(self, values):
+        payload = json.dumps({'o': self.ordering_name, 'v': values}, default=str, separators=(',', ':'))
+        return base64.urlsafe_b64encode(payload.encode()).decode()
+
+    def decode_cursor(self, encoded):
+        if not encoded:
+            return None
+        try:
+            cursor = json.loads(base64.urlsafe_b64decode(encoded.encode()).decode())
+        except (TypeError, ValueError, UnicodeDecodeError):
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(cursor, dict) or not isinstance(cursor.get('v'), list):
+            raise NotFound(self.invalid_cursor_message)
+        return cursor
+
+    @staticmethod
+    def _field_value(obj, name):
+        value = getattr(obj, name)
+        return value if isinstance(value, (int, float, str)) or value is None else str(value)
+
+
+class RankedFeedPagination(KeysetPagination):
+    """Always-on keyset pagination for the Turbo > Top > organic feed."""
+    opt_in = False
+    orderings = {
+        'ranked': ('-boost_priority', '-id'),
+    }
+    default_ordering = 'ranked'
+
+    def get_orderings(self, view):
+        return self.orderings
+
+
+class ChatHistoryPagination(KeysetPagination):
+    """Newest-first chat history; each page seeks before the oldest message already loaded."""
+    opt_in = False
+    page_size = 50
+    orderings = {
+        'newest': ('-timestamp', '-id'),
+    }
+    default_ordering = 'newest'
+
+    def get_orderings(self, view):
+        return self.orderings
@@ -1,16 +1,18 @@
 from django.urls import re_path
-from channels.auth import AuthMiddlewareStack
 from channels.routing import ProtocolTypeRouter, URLRouter
 from . import consumers
+from .middleware import JWTAuthMiddleware
 
 application = ProtocolTypeRouter({
-    "websocket": AuthMiddlewareStack(
+    "websocket": JWTAuthMiddleware(
         URLRouter([
+            re_path(r'ws/chat/direct/(?P<user_id>\d+)/$', consumers.ChatConsumer.as_asgi()),
             re_path(r'ws/chat/(?P<room_name>\w+)/$', consumers.ChatConsumer.as_asgi()),
         ])
     ),
 })
 
 websocket_urlpatterns = [
+    re_path(r'ws/chat/direct/(?P<user_id>\d+)/$', consumers.ChatConsumer.as_asgi()),
     re_path(r'ws/chat/(?P<room_name>\w+)/$', consumers.ChatConsumer.as_asgi()),
 ]
@@ -1,8 +1,12 @@
+from django.db.models import Prefetch
+from django.utils import timezone
 from django.utils.html import strip_tags
 from django_elasticsearch_dsl import Document, Index, fields
 from django_elasticsearch_dsl.registries import registry
 from elasticsearch_dsl.analysis import analyzer, tokenizer, token_filter
-from api.models import Category, SubCategory, Vacancy, Service
+from api.models import (
+    Category, SubCategory, Vacancy, VacancyImage, Service, ServiceImage, Boost, ServiceBoost, VacancyBoost,
+)
 
 icu_transform_filter = token_filter(
     'icu_transform_filter',
@@ -37,6 +41,60 @@ autocomplete_search_analyzer = analyzer(
     ],
 )
 
+# Full-word analysis for long text: edge n-grams of descriptions would multiply
+# their terms, and prefix matches come from the titles and the completion field
+text_analyzer = analyzer(
+    'text_analyzer',
+    tokenizer='standard',
+    filter=[
+        'lowercase',
+        'asciifolding',
+        icu_transform_filter,
+        'snowball',
+    ],
+)
+
+
+def running_boosts(boost_model):
+    return Prefetch(
+        'boosts',
+        queryset=boost_model.objects.filter(is_active=True, end_date__gt=timezone.now()).select_related('boost'),
+        to_attr='running_boosts',
+    )
+
+
+def top_boost(instance):
+    """The running boost that sets the listing's `boost_priority`, or None."""
+    boosts = getattr(instance, 'running_boosts', None)
+    if boosts is None:
+        boosts = instance.boosts.filter(is_active=True, end_date__gt=timezone.now()).select_related('boost')
+    return max(boosts, key=lambda boost: Boost.PRIORITIES.get(boost.boost.boost_type, 0), default=None)
+
+
+def embedded_category():
+    return fields.ObjectField(properties={
+        'id': fields.IntegerField(),
+        'title': fields.KeywordField(index=False),
+        'display_ru': fields.KeywordField(index=False),
+        'display_uz': fields.KeywordField(index=False),
+    })
+
+
+def embedded_data(instance):
+    """The copy of a category or subcategory stored inside listing documents."""
+    return {
+        'id': instance.pk,
+        'title': instance.title,
+        'display_ru': instance.display_ru,
+        'display_uz': instance.display_uz,
+    }
+
+
+def suggest_inputs(*values):
+    """Completion inputs for the non-empty, distinct values (e.g. title, display_ru, display_uz)."""
+    return list(dict.fromkeys(value.strip() for value in values if value and value.strip()))
+
+
 category_index = Index('categories')
 category_index.settings(number_of_shards=1, number_of_replicas=0)
 
@@ -55,6 +113,7 @@ class CategoryDocument(Document):
         analyzer=autocomplete_analyzer,
         search_analyzer=autocomplete_search_analyzer
     )
+    suggest = fields.CompletionField()
 
     class Index:
         name = 'categories'
@@ -63,6 +122,9 @@ class CategoryDocument(Document):
         model = Category
         fields = ['id']
 
+    def prepare_suggest(self, instance):
+        return suggest_inputs(instance.title, instance.display_ru, instance.display_uz)
+
 
 @registry.register_document
 class SubCategoryDocument(Document):
@@ -78,6 +140,7 @@ class SubCategoryDocument(Document):
         analyzer=autocomplete_analyzer,
         search_analyzer=autocomplete_search_analyzer
     )
+    suggest = fields.CompletionField()
 
     class Index:
         name = 'sub_categories'
@@ -86,6 +149,9 @@ class SubCategoryDocument(Document):
         model = SubCategory
         fields = ['id']
 
+    def prepare_suggest(self, instance):
+        return suggest_inputs(instance.title, instance.display_ru, instance.display_uz)
+
 
 @registry.register_document
 class VacancyDocument(Document):
@@ -93,10 +159,19 @@ class VacancyDocument(Document):
         analyzer=autocomplete_analyzer,
         search_analyzer=autocomplete_search_analyzer
     )
-    description = fields.TextField(
-        analyzer=autocomplete_analyzer,
-        search_analyzer=autocomplete_search_analyzer
-    )
+    description = fields.TextField(analyzer=text_analyzer)
+    suggest = fields.CompletionField()
+    category_id = fields.IntegerField()
+    sub_category_ids = fields.IntegerField(multi=True)
+    region = fields.KeywordField()
+    moderation = fields.KeywordField()
+    rating = fields.FloatField()
+    boost_priority = fields.IntegerField()
+    boost_tier = fields.KeywordField()
+    boost_ends_at = fields.DateField()
+    category = embedded_category()
+    sub_categories = embedded_category()
+    image = fields.KeywordField(index=False)
 
     class Index:
         name = 'vacancies'
@@ -104,10 +179,62 @@ class VacancyDocument(Document):
     class Django:
         model = Vacancy
         fields = ['id', 'price']
+        related_models = [VacancyImage]
+
+    # Changes to these are copied in by update_by_query (see api.search.signals)
+    embedded = {Category: 'category', SubCategory: 'sub_categories'}
+
+    def get_queryset(self):
+        return super().get_queryset().filter(moderation='approved').select_related(
+            'client', 'category', 'sub_category'
+        ).prefetch_related(
+            running_boosts(VacancyBoost), Prefetch('vacancy_images', VacancyImage.objects.order_by('id'))
+        )
+
+    def should_index_object(self, obj):
+        return obj.moderation == 'approved'
+
+    def get_instances_from_related(self, related_instance):
+        return related_instance.vacancy
 
     def prepare_description(self, instance):
         return strip_tags(instance.description or "")
 
+    def prepare_sub_category_ids(self, instance):
+        return [instance.sub_category_id]
+
+    def prepare_category(self, instance):
+        return embedded_data(instance.category)
+
+    def prepare_sub_categories(self, instance):
+        return [embedded_data(instance.sub_category)]
+
+    def prepare_image(self, instance):
+        if instance.images:
+            return instance.images.url
+        image = next(iter(instance.vacancy_images.all()), None)
+        return image.image.url if image else None
+
+    def prepare_region(self, instance):
+        return instance.client.region
+
+    def prepare_moderation(self, instance):
+        return (instance.moderation or "").lower()
+
+    def prepare_rating(self, instance):
+        return instance.client.client_rating
+
+    def prepare_boost_tier(self, instance):
+        boost = top_boost(instance)
+        return boost.boost.boost_type if boost else None
+
+    def prepare_boost_ends_at(self, instance):
+        boost = top_boost(instance)
+        return boost.end_date if boost else None
+
+    def prepare_suggest(self, instance):
+        return suggest_inputs(instance.title)
+
 
 @registry.register_document
 class ServiceDocument(Document):
@@ -115,10 +242,19 @@ class ServiceDocument(Document):
         analyzer=autocomplete_analyzer,
         search_analyzer=autocomplete_search_analyzer
     )
-    description = fields.TextField(
-        analyzer=autocomplete_analyzer,
-        search_analyzer=autocomplete_search_analyzer
-    )
+    description = fields.TextField(analyzer=text_analyzer)
+    suggest = fields.CompletionField()
+    category_id = fields.IntegerField()
+    sub_category_ids = fields.IntegerField(multi=True)
+    region = fields.KeywordField()
+    moderation = fields.KeywordField()
+    rating = fields.FloatField()
+    boost_priority = fields.IntegerField()
+    boost_tier = fields.KeywordField()
+    boost_ends_at = fields.DateField()
+    category = embedded_category()
+    sub_categories = embedded_category()
+    image = fields.KeywordField(index=False)
 
     class Index:
         name = 'services'
@@ -126,6 +262,57 @@ class ServiceDocument(Document):
     class Django:
         model = Service
         fields = ['id', 'price']
+        related_models = [ServiceImage]
+
+    # Changes to these are copied in by update_by_query (see api.search.signals)
+    embedded = {Category: 'category', SubCategory: 'sub_categories'}
+
+    def get_queryset(self):
+        return super().get_queryset().filter(moderation=Service.COUNTED_MODERATION).select_related(
+            'executor', 'category'
+        ).prefetch_related(
+            'sub_categories', running_boosts(ServiceBoost), Prefetch('images', ServiceImage.objects.order_by('id'))
+        )
+
+    def should_index_object(self, obj):
+        return obj.moderation == Service.COUNTED_MODERATION
+
+    def get_instances_from_related(self, related_instance):
+        return related_instance.service
 
     def prepare_description(self, instance):
-        return strip_tags(instance.description or "")
\ No newline at end of file
+        return strip_tags(instance.description or "")
+
+    def prepare_sub_category_ids(self, instance):
+        return [sub_category.pk for sub_category in instance.sub_categories.all()]
+
+    def prepare_category(self, instance):
+        return embedded_data(instance.category)
+
+    def prepare_sub_categories(self, instance):
+        return [embedded_data(sub_category) for sub_category in instance.sub_categories.all()]
+
+    def prepare_image(self, instance):
+        image = next(iter(instance.images.all()), None)
+        return image.image.url if image else None
+
+    def prepare_region(self, instance):
+        return instance.executor.region
+
+    def prepare_moderation(self, instance):
+        # Services store 'Approved', vacancies 'approved'
+        return (instance.moderation or "").lower()
+
+    def prepare_rating(self, instance):
+        return instance.executor.executor_rating
+
+    def prepare_boost_tier(self, instance):
+        boost = top_boost(instance)
+        return boost.boost.boost_type if boost else None
+
+    def prepare_boost_ends_at(self, instance):
+        boost = top_boost(instance)
+        return boost.end_date if boost else None
+
+    def prepare_suggest(self, instance):
+        return suggest_inputs(instance.title)
\ No newline at end of file
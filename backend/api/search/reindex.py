@@ -0,0 +1,129 @@
+import hashlib
+import json
+import logging
+import re
+import time
+from collections import deque
+from datetime import timedelta
+
+from django.utils import timezone
+from django_elasticsearch_dsl.registries import registry
+from elasticsearch.helpers import parallel_bulk
+
+from api.models import SearchReindexHold
+
+logger = logging.getLogger("app")
+
+# A crashed run stops holding back the flush worker after this many seconds
+REINDEX_HOLD_TIMEOUT = 60 * 60
+
+VERSIONED_INDEX = re.compile(r'(?P<alias>.+)_[0-9a-f]{12}(_\d+)?')
+
+
+def index_alias(index_name):
+    """The alias a versioned index (`<alias>_<hash>` or `<alias>_<hash>_<timestamp>`) is built for."""
+    match = VERSIONED_INDEX.fullmatch(index_name)
+    return match.group('alias') if match else index_name
+
+
+def mapping_hash(doc_class):
+    body = json.dumps(doc_class._index.to_dict(), sort_keys=True, default=str)
+    return hashlib.sha1(body.encode()).hexdigest()[:12]
+
+
+class Reindexer:
+    """
+    Rebuilds a document type into a versioned index (`<alias>_<mapping hash>`)
+    and then points the alias at it in one atomic `_aliases` call, so searches
+    never see a missing or half-filled index.
+
+    Rows are streamed from the database with a server-side cursor
+    (`iterator(chunk_size)`) and sent with `parallel_bulk`. Refresh and replicas
+    are switched off during the load and restored before the swap.
+    """
+
+    def __init__(self, chunk_size=1000, thread_count=4, stdout=None):
+        self.chunk_size = chunk_size
+        self.thread_count = thread_count
+        self.stdout = stdout
+
+    def log(self, message):
+        logger.info(message)
+        if self.stdout:
+            self.stdout.write(message)
+
+    def run(self, doc_classes=None, force=False, keep_old=False):
+        doc_classes = doc_classes or sorted(registry.get_documents(), key=lambda doc: doc._index._name)
+        hold = SearchReindexHold.objects.create(expires_at=timezone.now() + timedelta(seconds=REINDEX_HOLD_TIMEOUT))
+        try:
+            return {doc._index._name: self.reindex(doc, force=force, keep_old=keep_old) for doc in doc_classes}
+        finally:
+            hold.delete()
+
+    def reindex(self, doc_class, force=False, keep_old=False):
+        es = doc_class._get_connection()
+        alias = doc_class._index._name
+        target = f'{alias}_{mapping_hash(doc_class)}'
+        current = self.aliased_indices(es, alias)
+        # A forced rebuild may have added a timestamp suffix to the versioned name
+        built = [name for name in current if name == target or name.startswith(f'{target}_')]
+
+        if built and not force:
+            self.log(f"{alias}: mapping unchanged ({built[0]}), skipped")
+            return 'unchanged'
+        if built:
+            # The alias keeps serving the current index until the swap, so build beside it
+            target = f'{target}_{int(time.time())}'
+
+        started = time.monotonic()
+        if es.indices.exists(index=target):
+            es.indices.delete(index=target)
+        index = doc_class._index.clone(name=target)
+        index.settings(refresh_interval='-1', number_of_replicas=0)
+        index.create(using=es)
+
+        count = self.load(es, doc_class, target)
+
+        replicas = doc_class._index._settings.get('number_of_replicas', 0)
+        es.indices.put_settings(index=target, body={'index': {'refresh_interval': None, 'number_of_replicas': replicas}})
+        es.indices.refresh(index=target)
+
+        actions = [{'remove': {'index': name, 'alias': alias}} for name in current if name != target]
+        if not current and es.indices.exists(index=alias):
+            # An index created by `search_index --rebuild` holds the alias name
+            actions.append({'remove_index': {'index': alias}})
+        actions.append({'add': {'index': target, 'alias': alias}})
+        es.indices.update_aliases(body={'actions': actions})
+
+        if not keep_old:
+            for name in current:
+                if name != target:
+                    es.indices.delete(index=name, ignore_unavailable=True)
+
+        self.log(f"{alias}: {count} documents -> {target} in {time.monotonic() - started:.1f}s")
+        return 'rebuilt'
+
+    @staticmethod
+    def aliased_indices(es, alias):
+        if not es.indices.exists_alias(name=alias):
+            return []
+        return sorted(es.indices.get_alias(name=alias))
+
+    def load(self, es, doc_class, target):
+        doc = doc_class()
+        queryset = doc.get_queryset().order_by('pk').iterator(chunk_size=self.chunk_size)
+        count, batch = 0, []
+        # Rows are read on this thread; only the bulk requests run in parallel
+        for action in doc._get_actions(queryset, 'index'):
+            action['_index'] = target
+            batch.append(action)
+            if len(batch) >= self.chunk_size * self.thread_count:
+                count += self.send(es, batch)
+                batch = []
+        if batch:
+            count += self.send(es, batch)
+        return count
+
+    def send(self, es, actions):
+        deque(parallel_bulk(es, actions, thread_count=self.thread_count, chunk_size=self.chunk_size), maxlen=0)
+        return len(actions)
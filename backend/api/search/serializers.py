@@ -1,7 +1,16 @@
 from django_elasticsearch_dsl_drf.serializers import DocumentSerializer
+from rest_framework import serializers
+
 from .documents import CategoryDocument, SubCategoryDocument, VacancyDocument, ServiceDocument
 
 
+class SourceField(serializers.ReadOnlyField):
+    """A `_source` value, or None for documents indexed before the field existed."""
+
+    def get_attribute(self, instance):
+        return instance.to_dict().get(self.source)
+
+
 class CategoryDocumentSerializer(DocumentSerializer):
     class Meta:
         document = CategoryDocument
@@ -14,13 +23,25 @@ class SubCategoryDocumentSerializer(DocumentSerializer):
         fields = ['id', 'title', 'display_ru', 'display_uz']
 
 
-class VacancyDocumentSerializer(DocumentSerializer):
+class ListingDocumentSerializer(DocumentSerializer):
+    """Everything a search result card needs, so no follow-up detail request is made."""
+    _abstract = True
+
+    category = SourceField()
+    sub_categories = SourceField()
+    image = SourceField()
+    region = SourceField()
+    rating = SourceField()
+    boost_tier = SourceField()
+
+
+class VacancyDocumentSerializer(ListingDocumentSerializer):
     class Meta:
         document = VacancyDocument
         fields = ['id', 'title', 'description', 'price']
 
 
-class ServiceDocumentSerializer(DocumentSerializer):
+class ServiceDocumentSerializer(ListingDocumentSerializer):
     class Meta:
         document = ServiceDocument
-        fields = ['id', 'title', 'description', 'price']
\ No newline at end of file
+        fields = ['id', 'title', 'description', 'price']
@@ -0,0 +1,151 @@
+import logging
+import time
+from collections import defaultdict
+from datetime import timedelta
+
+from django.apps import apps
+from django.conf import settings
+from django.core.exceptions import ObjectDoesNotExist
+from django.db import models, transaction
+from django.utils import timezone
+from django_elasticsearch_dsl.apps import DEDConfig
+from django_elasticsearch_dsl.registries import registry
+from django_elasticsearch_dsl.signals import RealTimeSignalProcessor
+from elasticsearch.helpers import bulk
+from elasticsearch_dsl import UpdateByQuery
+
+from api.models import SearchIndexQueue, SearchReindexHold
+from .documents import embedded_data
+
+logger = logging.getLogger("app")
+
+# Replaces every embedded object (or list item) whose id is in params.objects
+EMBED_SCRIPT = """
+def value = ctx._source[params.field];
+def items = value instanceof List ? value : [value];
+boolean changed = false;
+for (item in items) {
+    def data = item == null ? null : params.objects[String.valueOf(item.id)];
+    if (data != null) { item.putAll(data); changed = true; }
+}
+if (!changed) { ctx.op = 'noop'; }
+"""
+
+
+class QueuedSignalProcessor(RealTimeSignalProcessor):
+    """
+    Records changed objects in `SearchIndexQueue` instead of calling
+    Elasticsearch inside the request.
+
+    The queue row is written in the same transaction as the change, so nothing
+    is indexed for a rolled-back save and nothing is lost if the worker is down.
+    """
+
+    def handle_save(self, sender, instance, **kwargs):
+        if not DEDConfig.autosync_enabled():
+            return
+        queued = [instance] if instance.__class__ in registry.get_models() else []
+        SearchIndexQueue.enqueue(queued + self.related_instances(instance))
+
+    def handle_pre_delete(self, sender, instance, **kwargs):
+        # Collected before the delete, while the relation still exists
+        if DEDConfig.autosync_enabled():
+            SearchIndexQueue.enqueue(self.related_instances(instance))
+
+    def handle_delete(self, sender, instance, **kwargs):
+        if DEDConfig.autosync_enabled() and instance.__class__ in registry.get_models():
+            SearchIndexQueue.enqueue([instance])
+
+    @staticmethod
+    def related_instances(instance):
+        related_instances = []
+        for doc in registry._get_related_doc(instance):
+            try:
+                related = doc().get_instances_from_related(instance)
+            except ObjectDoesNotExist:
+                related = None
+            if isinstance(related, models.Model):
+                related_instances.append(related)
+            elif related is not None:
+                related_instances.extend(related)
+        return related_instances
+
+
+def flush_search_queue(batch_size=500, debounce=None):
+    """
+    Index one batch of queued objects whose last change is older than `debounce`
+    seconds, with one bulk request per document type. Objects that no longer
+    exist (or should not be indexed) are removed from the index. Returns the
+    number of objects processed.
+    """
+    if SearchReindexHold.active():
+        return 0
+    debounce = settings.SEARCH_INDEX_DEBOUNCE if debounce is None else debounce
+    due = timezone.now() - timedelta(seconds=debounce)
+
+    # Rows are removed before indexing, so a change committed meanwhile queues a new row
+    with transaction.atomic():
+        rows = list(
+            SearchIndexQueue.objects.select_for_update(skip_locked=True)
+            .filter(queued_at__lte=due).order_by('queued_at')[:batch_size]
+        )
+        SearchIndexQueue.objects.filter(pk__in=[row.pk for row in rows]).delete()
+    if not rows:
+        return 0
+
+    started = time.monotonic()
+    ids_by_model = defaultdict(set)
+    for row in rows:
+        ids_by_model[row.model].add(row.object_id)
+
+    try:
+        for label, ids in ids_by_model.items():
+            model = apps.get_model(label)
+            for doc_class in registry.get_documents([model]):
+                index_documents(doc_class(), ids)
+            propagate_embedded(model, ids)
+    except Exception:
+        SearchIndexQueue.objects.bulk_create(
+            [SearchIndexQueue(model=row.model, object_id=row.object_id) for row in rows], ignore_conflicts=True
+        )
+        raise
+
+    logger.info(f"Поисковый индекс: обновлено {len(rows)} объектов за {(time.monotonic() - started) * 1000:.1f} ms")
+    return len(rows)
+
+
+def index_documents(doc, ids):
+    objects = [obj for obj in doc.get_queryset().filter(pk__in=ids) if doc.should_index_object(obj)]
+    if objects:
+        doc.update(objects, refresh=False)
+
+    gone = ids - {obj.pk for obj in objects}
+    if gone:
+        actions = ({'_op_type': 'delete', '_index': doc._index._name, '_id': pk} for pk in gone)
+        _, errors = bulk(doc._get_connection(), actions, raise_on_error=False)
+        errors = [error for error in errors if error.get('delete', {}).get('status') != 404]
+        if errors:
+            raise RuntimeError(f"Не удалось удалить документы из {doc._index._name}: {errors[:3]}")
+
+
+def propagate_embedded(model, ids):
+    """
+    Copy changed `model` objects into the documents that embed them (see
+    `Document.embedded`) with one `update_by_query` per index, instead of
+    queueing and rebuilding every listing of a renamed category.
+    """
+    objects = None
+    for doc_class in registry.get_documents():
+        field = getattr(doc_class, 'embedded', {}).get(model)
+        if not field:
+            continue
+        if objects is None:
+            objects = {str(obj.pk): embedded_data(obj) for obj in model.objects.filter(pk__in=ids)}
+        if not objects:
+            return
+        # A version conflict means the listing was just reindexed from the database, which is newer
+        update = UpdateByQuery(using=doc_class._get_connection(), index=doc_class._index._name).query(
+            'terms', **{f'{field}.id': [int(pk) for pk in objects]}
+        ).script(source=EMBED_SCRIPT, params={'field': field, 'objects': objects}).params(conflicts='proceed')
+        response = update.execute()
+        logger.info(f"{doc_class._index._name}: {field} обновлён в {response.updated} документах")
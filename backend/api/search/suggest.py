@@ -0,0 +1,73 @@
+import threading
+import time
+from collections import OrderedDict
+
+from elasticsearch_dsl import Search
+
+from .documents import CategoryDocument, SubCategoryDocument, VacancyDocument, ServiceDocument
+from .reindex import index_alias
+
+# alias -> section name in the response; hits name the versioned index behind it
+SUGGEST_SECTIONS = {
+    CategoryDocument._index._name: 'categories',
+    SubCategoryDocument._index._name: 'sub_categories',
+    VacancyDocument._index._name: 'vacancies',
+    ServiceDocument._index._name: 'services',
+}
+
+
+class SuggestCache:
+    """
+    Small per-process LRU for suggestion lists. Popular prefixes are answered
+    without a request to Elasticsearch; the TTL bounds how long a renamed or
+    new title takes to show up.
+    """
+
+    def __init__(self, maxsize=2048, ttl=60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+            if time.monotonic() - item[0] > self.ttl:
+                del self._items[key]
+                return None
+            self._items.move_to_end(key)
+            return item[1]
+
+    def set(self, key, value):
+        with self._lock:
+            self._items[key] = (time.monotonic(), value)
+            self._items.move_to_end(key)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+
+suggest_cache = SuggestCache()
+
+
+def get_suggestions(prefix: str, size: int = 10):
+    """Completion-suggester matches for `prefix` across every index, cached per (prefix, size)."""
+    prefix = ' '.join(prefix.split()).lower()
+    key = (prefix, size)
+    suggestions = suggest_cache.get(key)
+    if suggestions is None:
+        search = Search(index=list(SUGGEST_SECTIONS)).source(False).extra(size=0).suggest(
+            'suggest', prefix, completion={'field': 'suggest', 'size': size, 'skip_duplicates': True}
+        )
+        response = search.execute()
+        suggestions = [
+            {'text': option.text, 'type': SUGGEST_SECTIONS.get(index_alias(option._index)), 'id': int(option._id)}
+            for option in response.suggest.suggest[0].options
+        ]
+        suggest_cache.set(key, suggestions)
+    return suggestions
@@ -1,6 +1,7 @@
 from django.urls import path
-from .views import GlobalSearchView
+from .views import GlobalSearchView, SuggestView
 
 urlpatterns = [
     path('', GlobalSearchView.as_view(), name='global-search'),
+    path('suggest/', SuggestView.as_view(), name='search-suggest'),
 ]
\ No newline at end of file
@@ -1,14 +1,19 @@
+import logging
+
+from elasticsearch.exceptions import ElasticsearchException
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
-from elasticsearch_dsl import Q
+from elasticsearch_dsl import A, MultiSearch, Q
 
+from api.models import Boost
 from .documents import (
     CategoryDocument,
     SubCategoryDocument,
     VacancyDocument,
     ServiceDocument,
 )
+from .suggest import get_suggestions
 from .serializers import (
     CategoryDocumentSerializer,
     SubCategoryDocumentSerializer,
@@ -16,17 +21,61 @@ from .serializers import (
     ServiceDocumentSerializer,
 )
 
+logger = logging.getLogger("app")
+
 
 class GlobalSearchView(APIView):
-    def get(self, request):
-        query = request.GET.get("q")
-        if not query:
-            return Response(
-                {"detail": "Параметр 'q' обязателен."},
-                status=status.HTTP_400_BAD_REQUEST,
-            )
+    """
+    Searches every section with one `_msearch` round trip.
+
+    Each section has its own size and a server-side `timeout`, so a slow index
+    returns what it found in time instead of holding up the others. A section
+    that fails is returned empty and listed in `failed`.
+
+    Vacancies and services also take the filters below as `bool.filter`
+    clauses (unscored and cached by Elasticsearch) and return facet counts
+    for the filtered results in `facets`. With `ranking=boosted` their text
+    score is multiplied by the running boost tier and the owner's rating.
+    """
+    # name, document, serializer, size, listing (filtered, faceted and ranked)
+    sections = (
+        ("categories", CategoryDocument, CategoryDocumentSerializer, 5, False),
+        ("sub_categories", SubCategoryDocument, SubCategoryDocumentSerializer, 5, False),
+        ("vacancies", VacancyDocument, VacancyDocumentSerializer, 5, True),
+        ("services", ServiceDocument, ServiceDocumentSerializer, 5, True),
+    )
+    section_timeout = "300ms"
+    request_timeout = 2
 
-        q = Q(
+    # query parameter -> (field, value type); several values are comma-separated
+    term_filters = {
+        "category": ("category_id", int),
+        "sub_category": ("sub_category_ids", int),
+        "region": ("region", str),
+    }
+    # query parameter -> (field, range operator)
+    range_filters = {
+        "price_min": ("price", "gte"),
+        "price_max": ("price", "lte"),
+        "min_rating": ("rating", "gte"),
+        "min_boost": ("boost_priority", "gte"),
+    }
+    facets = {
+        "category": A("terms", field="category_id", size=20),
+        "sub_category": A("terms", field="sub_category_ids", size=20),
+        "region": A("terms", field="region", size=20),
+        "boost": A("terms", field="boost_priority"),
+        "rating": A("range", field="rating", ranges=[
+            {"key": "4+", "from": 4},
+            {"key": "3+", "from": 3},
+        ]),
+        "price": A("stats", field="price"),
+    }
+
+    ranking_modes = ("relevance", "boosted")
+
+    def get_query(self, query):
+        return Q(
             "multi_match",
             query=query,
             fuzziness="AUTO",
@@ -40,19 +89,126 @@ class GlobalSearchView(APIView):
             operator="or",
         )
 
-        categories = CategoryDocument.search().query(q)[:5]
-        sub_categories = SubCategoryDocument.search().query(q)[:5]
-        vacancies = VacancyDocument.search().query(q)[:5]
-        services = ServiceDocument.search().query(q)[:5]
+    def get_boosted_query(self, q):
+        """`q` scored by boost tier (while the boost runs) and by the owner's rating."""
+        functions = [
+            {
+                "filter": Q("term", boost_tier=boost_type) & Q("range", boost_ends_at={"gt": "now/m"}),
+                "weight": 1 + priority,
+            }
+            for boost_type, priority in Boost.PRIORITIES.items()
+        ]
+        # ln(2 + rating), so unrated listings keep a non-zero score
+        functions.append({"field_value_factor": {"field": "rating", "modifier": "ln2p", "missing": 0}})
+        return Q("function_score", query=q, functions=functions, score_mode="multiply", boost_mode="multiply")
+
+    def get_filters(self, params):
+        """Filter clauses from the query string; raises ValueError on a malformed value."""
+        filters = []
+        for param, (field, cast) in self.term_filters.items():
+            values = [value.strip() for raw in params.getlist(param) for value in raw.split(",") if value.strip()]
+            if values:
+                filters.append(Q("terms", **{field: [cast(value) for value in values]}))
+        for param, (field, operator) in self.range_filters.items():
+            value = params.get(param)
+            if value not in (None, ""):
+                filters.append(Q("range", **{field: {operator: float(value)}}))
+        return filters
+
+    @staticmethod
+    def facet_data(aggregation):
+        if "buckets" in aggregation:
+            return [{"value": bucket.key, "count": bucket.doc_count} for bucket in aggregation.buckets]
+        return aggregation.to_dict()
+
+    def get(self, request):
+        query = request.GET.get("q")
+        if not query:
+            return Response(
+                {"detail": "Параметр 'q' обязателен."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        try:
+            filters = self.get_filters(request.GET)
+        except ValueError:
+            return Response(
+                {"detail": "Некорректное значение фильтра."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        ranking = request.GET.get("ranking", self.ranking_modes[0])
+        if ranking not in self.ranking_modes:
+            return Response(
+                {"detail": f"Параметр 'ranking' должен быть одним из: {', '.join(self.ranking_modes)}."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        q = self.get_query(query)
+        listing_q = self.get_boosted_query(q) if ranking == "boosted" else q
+        multi_search = MultiSearch().params(request_timeout=self.request_timeout)
+        for _, document, _, size, listing in self.sections:
+            search = document.search().query(listing_q if listing else q).extra(timeout=self.section_timeout)[:size]
+            if listing:
+                for clause in filters:
+                    search = search.filter(clause)
+                for name, aggregation in self.facets.items():
+                    search.aggs.bucket(name, aggregation)
+            multi_search = multi_search.add(search)
+
+        try:
+            responses = multi_search.execute(raise_on_error=False)
+        except ElasticsearchException as e:
+            logger.error(f"Ошибка поиска '{query}': {e}")
+            responses = [None] * len(self.sections)
+
+        results, facets, failed, timed_out = {}, {}, [], []
+        for (name, _, serializer_class, _, listing), response in zip(self.sections, responses):
+            if response is None:
+                failed.append(name)
+                results[name] = []
+                continue
+            if response.timed_out:
+                timed_out.append(name)
+            results[name] = serializer_class(response, many=True).data
+            if listing:
+                facets[name] = {
+                    facet: self.facet_data(response.aggregations[facet]) for facet in self.facets
+                    if facet in response.aggregations
+                }
 
         data = {
             "query": query,
-            "results": {
-                "categories": CategoryDocumentSerializer(categories, many=True).data,
-                "sub_categories": SubCategoryDocumentSerializer(sub_categories, many=True).data,
-                "vacancies": VacancyDocumentSerializer(vacancies, many=True).data,
-                "services": ServiceDocumentSerializer(services, many=True).data,
-            },
+            "results": results,
+            "facets": facets,
+            "partial": bool(failed or timed_out),
+            "failed": failed,
+            "timed_out": timed_out,
         }
 
         return Response(data, status=status.HTTP_200_OK)
+
+
+class SuggestView(APIView):
+    """Search-as-you-type completions for `q` across categories, subcategories, vacancies and services."""
+    default_size = 10
+    max_size = 20
+
+    def get(self, request):
+        prefix = (request.GET.get("q") or "").strip()
+        if not prefix:
+            return Response(
+                {"detail": "Параметр 'q' обязателен."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        try:
+            size = max(1, min(int(request.GET.get("size", self.default_size)), self.max_size))
+        except ValueError:
+            size = self.default_size
+
+        try:
+            suggestions = get_suggestions(prefix, size)
+        except ElasticsearchException as e:
+            logger.error(f"Ошибка подсказок '{prefix}': {e}")
+            suggestions = []
+
+        return Response({"query": prefix, "suggestions": suggestions}, status=status.HTTP_200_OK)
@@ -1,15 +1,89 @@
 from random import choices
 
+from django.db import models
 from rest_framework import serializers
 
 from payme.models import PaymeTransactions
 from phonenumber_field.serializerfields import PhoneNumberField
 from .models import (
     User, Category, SubCategory, Service, ExecutorReview, Vacancy, ClientReview, Ad, OrderReview, Boost, ServiceBoost,
-    VacancyBoost, Order
+    VacancyBoost, Order, ChatRoom, Message
 )
 
-class VacancySerializer(serializers.ModelSerializer):
+class EagerLoadingMixin:
+    """
+    Declares the relations a serializer reads, so list views can load them
+    up front instead of issuing one query per row.
+    """
+    select_related_fields = ()
+    prefetch_related_fields = ()
+
+    @classmethod
+    def setup_eager_loading(cls, queryset, request=None):
+        if cls.select_related_fields:
+            queryset = queryset.select_related(*cls.select_related_fields)
+        if cls.prefetch_related_fields:
+            queryset = queryset.prefetch_related(*cls.prefetch_related_fields)
+        return queryset
+
+class DynamicFieldsMixin(EagerLoadingMixin):
+    """
+    Sparse fieldsets for GET requests on the top-level serializer.
+
+    `?fields=id,title` keeps only the listed fields. Relations in
+    `expandable_fields` are left out unless named in `?expand=`, and only
+    expanded relations are prefetched. `summary_fields`, when set, is the
+    default field set for list responses.
+    """
+    fields_query_param = 'fields'
+    expand_query_param = 'expand'
+    expandable_fields = {}
+    summary_fields = None
+
+    @classmethod
+    def get_requested(cls, request, param):
+        if request is None or request.method != 'GET':
+            return set()
+        value = request.query_params.get(param, '')
+        return {name.strip() for name in value.split(',') if name.strip()}
+
+    @classmethod
+    def get_expanded(cls, request):
+        return cls.get_requested(request, cls.expand_query_param) & set(cls.expandable_fields)
+
+    @classmethod
+    def setup_eager_loading(cls, queryset, request=None):
+        queryset = super().setup_eager_loading(queryset, request)
+        for name in cls.get_expanded(request):
+            serializer_class, _ = cls.expandable_fields[name]
+            related_queryset = serializer_class.setup_eager_loading(serializer_class.Meta.model.objects.all())
+            queryset = queryset.prefetch_related(models.Prefetch(name, queryset=related_queryset))
+        return queryset
+
+    def _is_top_level(self):
+        root = self.root
+        return root is self or getattr(root, 'child', None) is self
+
+    def get_fields(self):
+        fields = super().get_fields()
+        if not self._is_top_level():
+            return fields
+
+        request = self.context.get('request')
+        expanded = self.get_expanded(request)
+        for name in expanded:
+            serializer_class, kwargs = self.expandable_fields[name]
+            fields[name] = serializer_class(read_only=True, **kwargs)
+
+        only = self.get_requested(request, self.fields_query_param)
+        if not only and self.summary_fields is not None and self.context.get('summary'):
+            only = set(self.summary_fields)
+        if only:
+            for name in set(fields) - only - expanded:
+                fields.pop(name)
+        return fields
+
+class VacancySerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     price = serializers.DecimalField(max_digits=10, decimal_places=2, coerce_to_string=False)
     moderation_display = serializers.CharField(source='get_moderation_display', read_only=True)
     images = serializers.SerializerMethodField()
@@ -18,16 +92,19 @@ class VacancySerializer(serializers.ModelSerializer):
         model = Vacancy
         fields = [
             'id', 'title', 'description', 'price', 'category', 'sub_category',
-            'client', 'images', 'moderation', 'moderation_display', 'boost'
+            'client', 'images', 'moderation', 'moderation_display', 'boost', 'boost_priority'
         ]
-        read_only_fields = ['id', 'moderation_display']
+        read_only_fields = ['id', 'moderation_display', 'boost_priority']
 
     def get_images(self, obj):
         if obj.images:
             return obj.images.url
         return None
 
-class ServiceSerializer(serializers.ModelSerializer):
+class ServiceSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
+    select_related_fields = ('category', 'executor', 'boost')
+    prefetch_related_fields = ('sub_categories',)
+
     category_name = serializers.CharField(source='category.title', read_only=True)
     price = serializers.DecimalField(max_digits=10, decimal_places=2, coerce_to_string=False)
     sub_categories = serializers.PrimaryKeyRelatedField(
@@ -59,13 +136,15 @@ class ServiceSerializer(serializers.ModelSerializer):
             'moderation',
             'boost',
             'boost_name',
+            'boost_priority',
         ]
         read_only_fields = [
             'id',
             'executor_name',
             'category_name',
             'sub_categories_names',
-            'boost_name'
+            'boost_name',
+            'boost_priority',
         ]
 
     def get_images(self, obj):
@@ -73,10 +152,16 @@ class ServiceSerializer(serializers.ModelSerializer):
             return obj.images.url
         return None
 
-class UserSerializer(serializers.ModelSerializer):
+class UserSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     created_at = serializers.DateTimeField(format="%d.%m.%Y %H:%M", read_only=True)
-    vacancies = VacancySerializer(many=True, read_only=True)
-    services = ServiceSerializer(many=True, read_only=True)
+
+    expandable_fields = {
+        'vacancies': (VacancySerializer, {'many': True}),
+        'services': (ServiceSerializer, {'many': True}),
+    }
+    summary_fields = (
+        'id', 'name', 'phone', 'role', 'region', 'executor_rating', 'client_rating', 'avatar', 'is_trusted',
+    )
 
     class Meta:
         model = User
@@ -84,11 +169,10 @@ class UserSerializer(serializers.ModelSerializer):
             'id', 'name', 'phone', 'about_user', 'role', 'region',
             'executor_rating', 'work_experience', 'email',  'client_rating', 'telegram_username',
             'telegram_id', 'gender', 'avatar', 'birthday', 'lang', 'created_at', 'orders_count', 'is_trusted',
-            'vacancies', 'services'
         ]
         read_only_fields = ['id', 'created_at', 'executor_rating', 'client_rating']
 
-class CategorySerializer(serializers.ModelSerializer):
+class CategorySerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     created_at = serializers.DateTimeField(format="%d.%m.%Y %H:%M", read_only=True)
 
     class Meta:
@@ -103,7 +187,9 @@ class CategorySerializer(serializers.ModelSerializer):
         ]
         read_only_fields = ['id', 'service_count', 'created_at']
 
-class SubCategorySerializer(serializers.ModelSerializer):
+class SubCategorySerializer(DynamicFieldsMixin, serializers.ModelSerializer):
+    select_related_fields = ('category',)
+
     created_at = serializers.DateTimeField(format="%d.%m.%Y %H:%M", read_only=True)
     category_name = serializers.CharField(source='category.title', read_only=True)
 
@@ -120,14 +206,14 @@ class SubCategorySerializer(serializers.ModelSerializer):
         ]
         read_only_fields = ['id', 'category_name', 'service_count', 'created_at']
 
-class ExecutorReviewSerializer(serializers.ModelSerializer):
+class ExecutorReviewSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     created_at = serializers.DateTimeField(format="%d.%m.%Y %H:%M", read_only=True)
     class Meta:
         model = ExecutorReview
         fields = '__all__'
         read_only_fields = ('created_at',)
 
-class ClientReviewSerializer(serializers.ModelSerializer):
+class ClientReviewSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     created_at = serializers.DateTimeField(format="%d.%m.%Y %H:%M", read_only=True)
 
     class Meta:
@@ -143,9 +229,12 @@ class ClientReviewSerializer(serializers.ModelSerializer):
         ]
         read_only_fields = ['id', 'created_at']
 
-class AdSerializer(serializers.ModelSerializer):
+class AdSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
+    prefetch_related_fields = ('regions',)
+
     start_date = serializers.DateTimeField(format="%d.%m.%Y %H:%M", read_only=True)
     end_date = serializers.DateTimeField(format="%d.%m.%Y %H:%M", read_only=True)
+    regions = serializers.SlugRelatedField(many=True, read_only=True, slug_field='region')
 
     class Meta:
         model = Ad
@@ -155,18 +244,25 @@ class AdSerializer(serializers.ModelSerializer):
             'start_date',
             'end_date',
             'region',
+            'regions',
             'link',
         ]
         read_only_fields = ['id', 'start_date', 'end_date']
 
-class OrderReviewSerializer(serializers.ModelSerializer):
+    def validate_region(self, value):
+        unknown = Ad(region=value).unknown_regions()
+        if unknown:
+            raise serializers.ValidationError(f"Неизвестные регионы: {', '.join(unknown)}")
+        return value
+
+class OrderReviewSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     created_at = serializers.DateTimeField(format="%d.%m.%Y %H:%M", read_only=True)
     class Meta:
         model = OrderReview
         fields = '__all__'
         read_only_fields = ['created_at']
 
-class BoostSerializer(serializers.ModelSerializer):
+class BoostSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     price = serializers.DecimalField(max_digits=10, decimal_places=2, coerce_to_string=False)
     final_price = serializers.DecimalField(
         max_digits=10,
@@ -188,7 +284,9 @@ class BoostSerializer(serializers.ModelSerializer):
             'applies_to',
         ]
 
-class ServiceBoostSerializer(serializers.ModelSerializer):
+class ServiceBoostSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
+    select_related_fields = ('boost',)
+
     boost = BoostSerializer()
     start_date = serializers.DateTimeField(format="%d.%m.%Y %H:%M", read_only=True)
     end_date = serializers.DateTimeField(format="%d.%m.%Y %H:%M", read_only=True)
@@ -197,7 +295,9 @@ class ServiceBoostSerializer(serializers.ModelSerializer):
         model = ServiceBoost
         fields = ['id', 'service', 'boost', 'start_date', 'end_date', 'is_active']
 
-class VacancyBoostSerializer(serializers.ModelSerializer):
+class VacancyBoostSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
+    select_related_fields = ('boost',)
+
     boost = BoostSerializer()
     start_date = serializers.DateTimeField(format="%d.%m.%Y %H:%M", read_only=True)
     end_date = serializers.DateTimeField(format="%d.%m.%Y %H:%M", read_only=True)
@@ -242,11 +342,39 @@ class ResetPasswordSerializer(serializers.Serializer):
     otp_code = serializers.CharField(max_length=6)
     new_password = serializers.CharField(min_length=6)
 
-class OrderSerializer(serializers.ModelSerializer):
+class OrderSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Order
         fields = "__all__"
 
+class ChatRoomSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
+    class Meta:
+        model = ChatRoom
+        fields = ['id', 'name', 'user1', 'user2', 'is_direct', 'created_at']
+
+class ChatUserSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = User
+        fields = ['id', 'name', 'avatar']
+
+class InboxSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
+    user1 = ChatUserSerializer(read_only=True)
+    user2 = ChatUserSerializer(read_only=True)
+    unread_count = serializers.IntegerField(read_only=True)
+
+    class Meta:
+        model = ChatRoom
+        fields = [
+            'id', 'name', 'user1', 'user2', 'last_message_id', 'last_message_preview', 'last_message_at',
+            'last_message_sender', 'unread_count',
+        ]
+
+class MessageSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
+    class Meta:
+        model = Message
+        fields = ['id', 'room', 'sender', 'content', 'file', 'timestamp']
+        read_only_fields = fields
+
 class PaymentSerializer(serializers.ModelSerializer):
     class Meta:
         model = PaymeTransactions
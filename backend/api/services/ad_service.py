@@ -0,0 +1,48 @@
+import threading
+import time
+
+from django.utils import timezone
+
+from api.cache import get_catalog_version
+from api.models import Ad
+
+
+class AdService:
+    # Ads entering or leaving their window are handled per request; the TTL only
+    # bounds staleness when another worker changed ads and the cache is process-local.
+    SNAPSHOT_TTL = 60
+
+    _snapshot = None
+    _lock = threading.Lock()
+
+    @staticmethod
+    def build_snapshot():
+        """Serialize every ad that has not ended yet, with its set of regions."""
+        from api.serializers import AdSerializer
+
+        ads = Ad.objects.filter(end_date__gt=timezone.now()).prefetch_related('regions').order_by('-start_date', '-id')
+        return [
+            (ad.start_date, ad.end_date, frozenset(region.region for region in ad.regions.all()), data)
+            for ad, data in zip(ads, AdSerializer(ads, many=True).data)
+        ]
+
+    @classmethod
+    def get_snapshot(cls):
+        version = get_catalog_version('ads')
+        snapshot = cls._snapshot
+        if snapshot is None or snapshot[0] != version or time.monotonic() - snapshot[1] > cls.SNAPSHOT_TTL:
+            with cls._lock:
+                snapshot = cls._snapshot
+                if snapshot is None or snapshot[0] != version or time.monotonic() - snapshot[1] > cls.SNAPSHOT_TTL:
+                    snapshot = (version, time.monotonic(), cls.build_snapshot())
+                    cls._snapshot = snapshot
+        return snapshot[2]
+
+    @classmethod
+    def get_active_ads(cls, region=None, now=None):
+        """Ads showing right now in `region`; ads without regions are shown everywhere."""
+        now = now or timezone.now()
+        return [
+            data for start_date, end_date, regions, data in cls.get_snapshot()
+            if start_date <= now < end_date and (not regions or region in regions)
+        ]
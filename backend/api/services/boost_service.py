@@ -0,0 +1,38 @@
+import logging
+import time
+
+from django.db import transaction
+from django.utils import timezone
+
+from api.models import ServiceBoost, VacancyBoost
+
+logger = logging.getLogger("app")
+
+
+class BoostService:
+
+    @staticmethod
+    def expire_overdue(now=None):
+        """Deactivate every overdue boost with one UPDATE per table and refresh the stored priorities."""
+        now = now or timezone.now()
+        started = time.perf_counter()
+        stats = {}
+
+        for name, boost_model, target_field in (
+            ("services", ServiceBoost, "service_id"),
+            ("vacancies", VacancyBoost, "vacancy_id"),
+        ):
+            with transaction.atomic():
+                overdue = boost_model.objects.filter(is_active=True, end_date__lt=now)
+                target_ids = list(overdue.values_list(target_field, flat=True).distinct())
+                expired = overdue.update(is_active=False) if target_ids else 0
+                if target_ids:
+                    boost_model.refresh_priorities(target_ids)
+            stats[name] = expired
+
+        stats["duration_ms"] = round((time.perf_counter() - started) * 1000, 1)
+        logger.info(
+            "BoostService: expired %d service boosts and %d vacancy boosts in %.1f ms",
+            stats["services"], stats["vacancies"], stats["duration_ms"],
+        )
+        return stats
@@ -0,0 +1,178 @@
+import fcntl
+import glob
+import json
+import os
+import re
+import time
+import uuid
+
+from django.conf import settings
+from django.core.files import File
+
+from api.models import Message
+
+
+UPLOAD_ID = re.compile(r'\d+-[0-9a-f]{32}')
+
+
+class UploadError(Exception):
+    pass
+
+
+class ChunkedUpload:
+    """
+    A chat attachment received as binary websocket frames.
+
+    Chunks are appended to a partial file under CHAT_UPLOAD_TEMP_DIR, so memory
+    per upload is bounded by one frame. The upload metadata is kept in a JSON
+    file next to it, so any worker that can see the partial file can resume it:
+    a client that reconnects within CHAT_UPLOAD_TTL seconds sends the same
+    upload_id and continues from the returned offset. The connection that
+    started or resumed an upload holds an exclusive lock on the partial file
+    until it finishes or disconnects, so two connections cannot append to the
+    same upload. Partial files older than CHAT_UPLOAD_TTL are swept when an
+    upload starts, and each user may keep at most CHAT_UPLOAD_MAX_PENDING of them.
+    """
+
+    def __init__(self, upload_id, user_id, room_id, file_name, size):
+        self.upload_id = upload_id
+        self.user_id = user_id
+        self.room_id = room_id
+        self.file_name = file_name
+        self.size = size
+        self.handle = None
+        self.offset = 0
+
+    @staticmethod
+    def temp_dir():
+        path = settings.CHAT_UPLOAD_TEMP_DIR
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    @property
+    def path(self):
+        return os.path.join(self.temp_dir(), f'{self.upload_id}.part')
+
+    @property
+    def meta_path(self):
+        return os.path.join(self.temp_dir(), f'{self.upload_id}.json')
+
+    @property
+    def complete(self):
+        return self.offset == self.size
+
+    @classmethod
+    def start(cls, user_id, room_id, file_name, size, upload_id=None):
+        """Resume `upload_id` if it belongs to this user and room, otherwise start a new upload."""
+        cls.sweep()
+        if upload_id:
+            upload = cls.load(str(upload_id))
+            if upload and upload.user_id == user_id and upload.room_id == room_id:
+                upload.acquire()
+                return upload
+
+        file_name = os.path.basename(str(file_name or '')).strip()
+        if not file_name:
+            raise UploadError('Не указано имя файла')
+        try:
+            size = int(size)
+        except (TypeError, ValueError):
+            raise UploadError('Не указан размер файла')
+        if size <= 0 or size > settings.CHAT_UPLOAD_MAX_SIZE:
+            raise UploadError(f'Размер файла должен быть от 1 до {settings.CHAT_UPLOAD_MAX_SIZE} байт')
+
+        if cls.pending_count(user_id) >= settings.CHAT_UPLOAD_MAX_PENDING:
+            raise UploadError('Слишком много незавершённых загрузок')
+
+        meta = {'user_id': user_id, 'room_id': room_id, 'file_name': file_name, 'size': size}
+        # The user id prefix lets pending_count find the user's partial files
+        upload = cls(upload_id=f'{user_id}-{uuid.uuid4().hex}', **meta)
+        with open(upload.meta_path, 'w') as f:
+            json.dump(meta, f)
+        # Created before its first chunk, so the upload already counts as pending
+        upload.acquire()
+        return upload
+
+    @classmethod
+    def load(cls, upload_id):
+        # The id comes from the client and names files on disk
+        if not UPLOAD_ID.fullmatch(upload_id):
+            return None
+        try:
+            with open(os.path.join(cls.temp_dir(), f'{upload_id}.json')) as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return cls(upload_id=upload_id, **meta)
+
+    @classmethod
+    def pending_count(cls, user_id):
+        return len(glob.glob(os.path.join(cls.temp_dir(), f'{user_id}-*.part')))
+
+    @classmethod
+    def sweep(cls, max_age=None):
+        """
+        Delete uploads whose partial file was not written to for `max_age`
+        (CHAT_UPLOAD_TTL) seconds, unless a connection still holds them.
+        """
+        cutoff = time.time() - (settings.CHAT_UPLOAD_TTL if max_age is None else max_age)
+        removed = 0
+        with os.scandir(cls.temp_dir()) as entries:
+            for entry in entries:
+                if not entry.name.endswith('.part'):
+                    continue
+                upload = cls(entry.name[:-len('.part')], None, None, None, None)
+                try:
+                    if entry.stat().st_mtime >= cutoff:
+                        continue
+                    upload.acquire()
+                except (FileNotFoundError, UploadError):
+                    continue  # Swept by another process or still being uploaded
+                upload.discard()
+                removed += 1
+        return removed
+
+    def acquire(self):
+        """Lock the partial file for this connection and continue from its current size."""
+        handle = open(self.path, 'ab')
+        try:
+            fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            handle.close()
+            raise UploadError('Загрузка уже продолжается в другом соединении')
+        self.handle = handle
+        self.offset = os.fstat(handle.fileno()).st_size
+
+    def release(self):
+        """Unlock the partial file, keeping it on disk so the upload can be resumed."""
+        if self.handle is not None:
+            self.handle.close()
+            self.handle = None
+
+    def append(self, chunk: bytes) -> int:
+        if len(chunk) > settings.CHAT_UPLOAD_CHUNK_SIZE:
+            raise UploadError(f'Фрагмент больше {settings.CHAT_UPLOAD_CHUNK_SIZE} байт')
+        if self.offset + len(chunk) > self.size:
+            raise UploadError('Получено больше данных, чем заявлено')
+        self.handle.write(chunk)
+        self.handle.flush()
+        self.offset += len(chunk)
+        return self.offset
+
+    def finish(self) -> Message:
+        """Stream the assembled file into storage and create the chat message."""
+        with open(self.path, 'rb') as f:
+            message = Message.objects.create(
+                room_id=self.room_id, sender_id=self.user_id, file=File(f, name=self.file_name)
+            )
+        self.discard()
+        return message
+
+    def discard(self):
+        # Removed while still locked, so no other connection can resume it in between
+        for path in (self.meta_path, self.path):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        self.release()
@@ -1,3 +1,4 @@
+import hmac
 import random
 import uuid
 from datetime import timedelta
@@ -6,7 +7,7 @@ from django.utils import timezone
 from django.utils.formats import date_format
 from rest_framework.exceptions import ValidationError
 
-from api.models import OTP_table
+from api.services.otp_storage import get_otp_storage
 from config import settings
 
 
@@ -25,27 +26,19 @@ class OTPService:
 
     @staticmethod
     def create_otp(phone: str):
-        now = timezone.now()
-        resend_limit = now - timedelta(seconds=OTPService.RESEND_TIMEOUT)
-        session_id = str(uuid.uuid4())
-
-        recent_otp = OTP_table.objects.filter(phone=phone, created_at__gt=resend_limit).first()
-        if recent_otp:
-            seconds_left = OTPService.RESEND_TIMEOUT - int((now - recent_otp.created_at).total_seconds())
+        storage = get_otp_storage()
+        seconds_left = storage.acquire_resend_lock(phone, OTPService.RESEND_TIMEOUT)
+        if seconds_left:
             raise ValidationError({
                 "error": "OTP already sent recently. Please wait before requesting again.",
-                "seconds_left": max(seconds_left, 0)
+                "seconds_left": seconds_left
             })
 
+        session_id = str(uuid.uuid4())
         code = OTPService.generate_code()
-        expires_at = now + timedelta(seconds=OTPService.OTP_LIFETIME)
+        expires_at = timezone.now() + timedelta(seconds=OTPService.OTP_LIFETIME)
 
-        otp = OTP_table.objects.create(
-            phone=phone,
-            code=code,
-            expires_at=expires_at,
-            session_id=session_id
-        )
+        storage.create(phone=phone, code=code, session_id=session_id, expires_at=expires_at)
 
         formatted_time = OTPService.format_expiration(expires_at)
 
@@ -60,27 +53,40 @@ class OTPService:
 
     @staticmethod
     def get_otp_by_session_id(session_id: str):
-        otp = OTP_table.objects.filter(session_id=session_id).first()
+        otp = get_otp_storage().get_by_session(session_id)
         if not otp or timezone.now() > otp.expires_at:
             return None
         return otp
 
+    @staticmethod
+    def get_latest_otp(phone: str):
+        return get_otp_storage().get_latest(phone)
+
+    @staticmethod
+    def check_code(otp, code: str) -> bool:
+        return otp is not None and hmac.compare_digest(str(otp.code), str(code))
+
+    @staticmethod
+    def delete_otp(otp):
+        get_otp_storage().delete(otp)
+
     @staticmethod
     def verify_otp(phone: str, code: str):
-        otp = OTP_table.objects.filter(phone=phone, code=code).last()
+        otp = OTPService.get_latest_otp(phone)
 
-        if not otp:
+        if not OTPService.check_code(otp, code):
             return False, "Invalid code"
 
         if timezone.now() > otp.expires_at:
-            otp.delete()
+            OTPService.delete_otp(otp)
             return False, "Code expired"
 
         return True, "Code verified"
 
     @staticmethod
     def attach_telegram_data(session_id: str, telegram_id: int, telegram_username: str = None):
-        otp = OTP_table.objects.filter(session_id=session_id).first()
+        storage = get_otp_storage()
+        otp = storage.get_by_session(session_id)
 
         if not otp:
             return False, "OTP с таким session_id не найден."
@@ -88,8 +94,6 @@ class OTPService:
         if timezone.now() > otp.expires_at:
             return False, "OTP истёк."
 
-        otp.telegram_id = telegram_id
-        otp.telegram_username = telegram_username
-        otp.save(update_fields=["telegram_id", "telegram_username"])
+        storage.attach_telegram(otp, telegram_id, telegram_username)
 
-        return True, "Telegram данные успешно сохранены."
\ No newline at end of file
+        return True, "Telegram данные успешно сохранены."
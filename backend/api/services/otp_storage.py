@@ -0,0 +1,131 @@
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from phonenumber_field.phonenumber import to_python
+
+from api.models import OTP_table
+
+
+def normalize_phone(phone) -> str:
+    number = to_python(phone)
+    if number is not None and number.is_valid():
+        return number.as_e164
+    return str(phone)
+
+
+class DatabaseOTPStorage:
+    """Keeps OTPs in `OTP_table`. Works without a shared cache."""
+
+    def acquire_resend_lock(self, phone: str, timeout: int) -> int:
+        """Return 0 if a new OTP may be sent now, otherwise the seconds left to wait."""
+        now = timezone.now()
+        recent = OTP_table.objects.filter(
+            phone=phone, created_at__gt=now - timedelta(seconds=timeout)
+        ).order_by('-created_at').first()
+        if recent:
+            return max(timeout - int((now - recent.created_at).total_seconds()), 1)
+        return 0
+
+    def create(self, phone: str, code: str, session_id: str, expires_at: datetime):
+        OTP_table.objects.filter(phone=phone, expires_at__lt=timezone.now()).delete()
+        return OTP_table.objects.create(phone=phone, code=code, session_id=session_id, expires_at=expires_at)
+
+    def get_by_session(self, session_id: str):
+        return OTP_table.objects.filter(session_id=session_id).first()
+
+    def get_latest(self, phone: str):
+        return OTP_table.objects.filter(phone=phone).order_by('-created_at').first()
+
+    def attach_telegram(self, otp, telegram_id: int, telegram_username: str = None):
+        otp.telegram_id = telegram_id
+        otp.telegram_username = telegram_username
+        otp.save(update_fields=["telegram_id", "telegram_username"])
+
+    def delete(self, otp):
+        otp.delete()
+
+
+class CacheOTPStorage:
+    """
+    Keeps OTPs in the Django cache with a TTL equal to their lifetime.
+
+    Requires a cache shared by all workers (Redis). The resend lock is a single
+    `cache.add`, so two concurrent requests for the same phone cannot both win.
+    """
+    prefix = "otp"
+
+    def _key(self, *parts):
+        return ":".join((self.prefix, *map(str, parts)))
+
+    def _to_otp(self, data):
+        return OTP_table(**data) if data else None
+
+    def acquire_resend_lock(self, phone: str, timeout: int) -> int:
+        unlock_at = timezone.now() + timedelta(seconds=timeout)
+        key = self._key("resend", normalize_phone(phone))
+        if cache.add(key, unlock_at, timeout):
+            return 0
+        current = cache.get(key)
+        if current is None:
+            return 1
+        return max(int((current - timezone.now()).total_seconds()), 1)
+
+    def create(self, phone: str, code: str, session_id: str, expires_at: datetime):
+        data = {
+            "session_id": session_id,
+            "phone": normalize_phone(phone),
+            "code": code,
+            "created_at": timezone.now(),
+            "expires_at": expires_at,
+            "telegram_id": None,
+            "telegram_username": None,
+        }
+        self._store(data)
+        return self._to_otp(data)
+
+    def _store(self, data):
+        ttl = int((data["expires_at"] - timezone.now()).total_seconds())
+        if ttl <= 0:
+            return
+        cache.set_many({
+            self._key("session", data["session_id"]): data,
+            self._key("phone", data["phone"]): data["session_id"],
+        }, ttl)
+
+    def get_by_session(self, session_id: str):
+        return self._to_otp(cache.get(self._key("session", session_id)))
+
+    def get_latest(self, phone: str):
+        session_id = cache.get(self._key("phone", normalize_phone(phone)))
+        if not session_id:
+            return None
+        return self.get_by_session(session_id)
+
+    def attach_telegram(self, otp, telegram_id: int, telegram_username: str = None):
+        data = cache.get(self._key("session", otp.session_id))
+        if not data:
+            return
+        data.update(telegram_id=telegram_id, telegram_username=telegram_username)
+        self._store(data)
+        otp.telegram_id = telegram_id
+        otp.telegram_username = telegram_username
+
+    def delete(self, otp):
+        phone_key = self._key("phone", normalize_phone(otp.phone))
+        keys = [self._key("session", otp.session_id)]
+        if cache.get(phone_key) == str(otp.session_id):
+            keys.append(phone_key)
+        cache.delete_many(keys)
+
+
+_storage = None
+
+
+def get_otp_storage():
+    global _storage
+    if _storage is None:
+        _storage = import_string(getattr(settings, "OTP_STORAGE", "api.services.otp_storage.DatabaseOTPStorage"))()
+    return _storage
@@ -3,14 +3,15 @@ from django.contrib.auth import authenticate
 from rest_framework_simplejwt.tokens import RefreshToken
 from rest_framework.exceptions import AuthenticationFailed, NotFound
 from rest_framework.exceptions import ValidationError
-from api.models import OTP_table, User
+from api.models import User
+from api.services.otp_service import OTPService
 
 
 class UserService:
 
     @staticmethod
     def register_user(phone: str, password: str, **kwargs):
-        otp = OTP_table.objects.filter(phone=phone).order_by('-created_at').first()
+        otp = OTPService.get_latest_otp(phone)
         if User.objects.filter(phone=phone).exists():
             raise ValidationError("Пользователь с таким номером уже зарегистрирован.")
 
@@ -20,12 +21,13 @@ class UserService:
         user = User.objects.create_user(
             phone=phone,
             password=password,
-            telegram_id=otp.telegram_id,
-            telegram_username=otp.telegram_username,
+            telegram_id=otp.telegram_id if otp else None,
+            telegram_username=otp.telegram_username if otp else None,
             **kwargs
         )
 
-        otp.delete()
+        if otp:
+            OTPService.delete_otp(otp)
         return user
 
     @staticmethod
@@ -37,6 +39,8 @@ class UserService:
             raise AuthenticationFailed("Неверный номер телефона или пароль.")
 
         refresh = RefreshToken.for_user(user)
+        # Copied into access tokens; chat websockets read the sender name from it
+        refresh["name"] = user.name
 
         return {
             "refresh": str(refresh),
@@ -95,8 +99,8 @@ class UserService:
     @staticmethod
     def reset_password(phone: str, otp_code: str, new_password: str):
         """Reset password with OTP code"""
-        otp = OTP_table.objects.filter(phone=phone, code=otp_code).last()
-        if not otp:
+        otp = OTPService.get_latest_otp(phone)
+        if not OTPService.check_code(otp, otp_code):
             raise ValidationError("Неверный код подтверждения.")
         if timezone.now() > otp.expires_at:
             raise ValidationError("Срок действия кода истёк.")
@@ -110,6 +114,6 @@ class UserService:
         user.save()
 
         # Delete OTP
-        otp.delete()
+        OTPService.delete_otp(otp)
 
         return {"message": "Пароль успешно обновлён."}
\ No newline at end of file
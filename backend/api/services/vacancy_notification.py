@@ -1,5 +1,14 @@
-import requests
 import logging
+import time
+from datetime import timedelta
+
+import requests
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from requests.adapters import HTTPAdapter
+
+from api.models import NotificationOutbox
 from config import settings
 
 BOT_SERVICE_URL = getattr(settings, "BOT_SERVICE_URL", "http://bot-service:8000")
@@ -7,19 +16,10 @@ BOT_SERVICE_TOKEN = getattr(settings, "BOT_SERVICE_TOKEN", None)
 
 logger = logging.getLogger("app")
 
-def notify_vacancy(vacancy):
-    if not BOT_SERVICE_TOKEN:
-        logger.warning(f"BOT_SERVICE_TOKEN не задан. Уведомление о вакансии {vacancy.id} не отправлено.")
-        return
-
-    url = f"{BOT_SERVICE_URL}/send_vacancy_notification/"
-    headers = {
-        "Content-Type": "application/json",
-        "X-Internal-Token": BOT_SERVICE_TOKEN,
-    }
 
+def build_vacancy_payload(vacancy):
     client = vacancy.client
-    data = {
+    return {
         "id": vacancy.id,
         "title": vacancy.title,
         "description": vacancy.description,
@@ -28,29 +28,13 @@ def notify_vacancy(vacancy):
         "phone": str(getattr(client, "phone", "")) if getattr(client, "phone", None) else None,
     }
 
-    try:
-        response = requests.post(url, json=data, headers=headers, timeout=5)
-        response.raise_for_status()
-        logger.info(f"✅ Уведомление о вакансии {vacancy.id} отправлено боту. Ответ: {response.text}")
-    except requests.RequestException as e:
-        logger.error(f"Ошибка при отправке уведомления о вакансии {vacancy.id}: {e}")
-
-def notify_service(service):
-    if not BOT_SERVICE_TOKEN:
-        logger.warning(f"BOT_SERVICE_TOKEN не задан. Уведомление о сервисе {service.id} не отправлено.")
-        return
-
-    url = f"{BOT_SERVICE_URL}/send_service_notification/"
-    headers = {
-        "Content-Type": "application/json",
-        "X-Internal-Token": BOT_SERVICE_TOKEN,
-    }
 
+def build_service_payload(service):
     executor = getattr(service, "executor", None)
     category = getattr(service, "category", None)
     boost = getattr(service, "boost", None)
 
-    data = {
+    return {
         "id": service.id,
         "title": service.title,
         "description": service.description,
@@ -61,9 +45,138 @@ def notify_service(service):
         "boost_name": getattr(boost, "name", None)
     }
 
-    try:
-        response = requests.post(url, json=data, headers=headers, timeout=5)
+
+def enqueue_vacancy(vacancy):
+    """Queue a bot notification; call inside the transaction that creates the vacancy."""
+    if not BOT_SERVICE_TOKEN:
+        logger.warning(f"BOT_SERVICE_TOKEN не задан. Уведомление о вакансии {vacancy.id} не отправлено.")
+        return
+    NotificationOutbox.objects.create(kind="vacancy", payload=build_vacancy_payload(vacancy))
+
+
+def enqueue_service(service):
+    """Queue a bot notification; call inside the transaction that creates the service."""
+    if not BOT_SERVICE_TOKEN:
+        logger.warning(f"BOT_SERVICE_TOKEN не задан. Уведомление о сервисе {service.id} не отправлено.")
+        return
+    NotificationOutbox.objects.create(kind="service", payload=build_service_payload(service))
+
+
+class CircuitBreaker:
+    """Stops calling the bot service for `reset_timeout` seconds after `threshold` failures in a row."""
+
+    def __init__(self, threshold=5, reset_timeout=30):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+
+    def allow(self):
+        if self.opened_at is None:
+            return True
+        # Half-open: let one request through once the timeout has passed
+        return time.monotonic() - self.opened_at >= self.reset_timeout
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+
+    def record_failure(self):
+        self.failures += 1
+        if self.failures >= self.threshold:
+            self.opened_at = time.monotonic()
+
+
+class NotificationDelivery:
+    """Drains NotificationOutbox over one pooled keep-alive HTTP session."""
+
+    ENDPOINTS = {
+        "vacancy": "/send_vacancy_notification/",
+        "service": "/send_service_notification/",
+    }
+    BATCH_SIZE = 50
+    LEASE_SECONDS = 60
+    MAX_ATTEMPTS = 8
+    BASE_BACKOFF = 5
+    MAX_BACKOFF = 3600
+    TIMEOUT = 5
+
+    def __init__(self, breaker=None):
+        self.session = requests.Session()
+        self.session.mount("http://", HTTPAdapter(pool_maxsize=4))
+        self.session.mount("https://", HTTPAdapter(pool_maxsize=4))
+        self.session.headers.update({
+            "Content-Type": "application/json",
+            "X-Internal-Token": BOT_SERVICE_TOKEN or "",
+        })
+        self.breaker = breaker or CircuitBreaker()
+
+    def claim_batch(self):
+        """Lease due rows so concurrent workers and crashed runs never send a row twice at once."""
+        now = timezone.now()
+        with transaction.atomic():
+            batch = list(
+                NotificationOutbox.objects.select_for_update(skip_locked=True)
+                .filter(status="pending", next_attempt_at__lte=now)
+                .order_by("next_attempt_at", "id")[:self.BATCH_SIZE]
+            )
+            if batch:
+                NotificationOutbox.objects.filter(pk__in=[item.pk for item in batch]).update(
+                    next_attempt_at=now + timedelta(seconds=self.LEASE_SECONDS)
+                )
+        return batch
+
+    def send(self, item):
+        response = self.session.post(
+            f"{BOT_SERVICE_URL}{self.ENDPOINTS[item.kind]}", json=item.payload, timeout=self.TIMEOUT
+        )
         response.raise_for_status()
-        logger.info(f"✅ Уведомление о сервисе {service.id} отправлено боту. Ответ: {response.text}")
-    except requests.RequestException as e:
-        logger.error(f"Ошибка при отправке уведомления о сервисе {service.id}: {e}")
\ No newline at end of file
+
+    def backoff(self, attempts):
+        return min(self.BASE_BACKOFF * 2 ** (attempts - 1), self.MAX_BACKOFF)
+
+    def record_failure(self, item, error):
+        attempts = item.attempts + 1
+        logger.error(f"Ошибка при отправке уведомления {item.kind} {item.payload.get('id')}: {error!r}")
+        NotificationOutbox.objects.filter(pk=item.pk).update(
+            attempts=F("attempts") + 1,
+            last_error=repr(error)[:1000],
+            status="failed" if attempts >= self.MAX_ATTEMPTS else "pending",
+            next_attempt_at=timezone.now() + timedelta(seconds=self.backoff(attempts)),
+        )
+
+    def deliver_batch(self):
+        batch = self.claim_batch()
+        sent, failed, deferred = [], 0, []
+
+        for item in batch:
+            if not self.breaker.allow():
+                deferred.append(item.pk)
+                continue
+            try:
+                self.send(item)
+            except requests.RequestException as e:
+                self.breaker.record_failure()
+                failed += 1
+                self.record_failure(item, e)
+            except Exception as e:
+                # A bad row (unknown kind, unserializable payload) must not stop the worker;
+                # it says nothing about the bot service, so the breaker is left alone
+                failed += 1
+                self.record_failure(item, e)
+            else:
+                self.breaker.record_success()
+                sent.append(item.pk)
+
+        if sent:
+            NotificationOutbox.objects.filter(pk__in=sent).delete()
+        if deferred:
+            NotificationOutbox.objects.filter(pk__in=deferred).update(
+                next_attempt_at=timezone.now() + timedelta(seconds=self.breaker.reset_timeout)
+            )
+
+        if batch:
+            logger.info(
+                f"Уведомления боту: отправлено {len(sent)}, ошибок {failed}, отложено {len(deferred)}"
+            )
+        return {"sent": len(sent), "failed": failed, "deferred": len(deferred)}
@@ -1,3 +1,1175 @@
-from django.test import TestCase
+import base64
+import json
+import os
+import tempfile
+import time
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
+from urllib.parse import parse_qs, urlparse
 
-# Create your tests here.
+import requests
+from asgiref.sync import async_to_sync
+from asgiref.testing import ApplicationCommunicator
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import IntegrityError, connection, transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from . import consumers
+from .cache import CATALOG_CACHE_TIMEOUT
+from .search import suggest
+from .search.documents import CategoryDocument, ServiceDocument, VacancyDocument
+from .search.reindex import Reindexer, mapping_hash
+from .search.signals import flush_search_queue
+from .middleware import JWTAuthMiddleware
+from .models import (
+    User, Category, SubCategory, Service, Vacancy, Boost, ServiceBoost, VacancyBoost, Order, ExecutorReview, Ad,
+    NotificationOutbox, ChatRoom, Message, ChatMembership, SearchIndexQueue, SearchReindexHold,
+)
+from .services import otp_storage, vacancy_notification
+from .services.boost_service import BoostService
+from .services.chat_upload import ChunkedUpload, UploadError
+from .services.otp_service import OTPService
+
+
+class KeysetPaginationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.executor = User.objects.create_user(phone='+998901234567')
+        cls.category = Category.objects.create(title='Ремонт')
+        cls.sub_category = SubCategory.objects.create(title='Сантехника', category=cls.category)
+        for i in range(7):
+            Service.objects.create(
+                title=f'Service {i}',
+                description='...',
+                category=cls.category,
+                executor=cls.executor,
+                price=Decimal('100.00') * (i % 3 + 1),
+            )
+
+    def setUp(self):
+        self.client = APIClient()
+
+    def collect(self, url):
+        ids = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            ids.extend(row['id'] for row in response.data['results'])
+            url = response.data['next']
+        return ids
+
+    def test_unpaginated_by_default(self):
+        response = self.client.get('/api/services/')
+        self.assertIsInstance(response.data, list)
+        self.assertEqual(len(response.data), 7)
+
+    def test_pages_follow_id_ordering(self):
+        ids = self.collect('/api/services/?page_size=3')
+        expected = list(Service.objects.order_by('-id').values_list('id', flat=True))
+        self.assertEqual(ids, expected)
+
+    def test_pages_follow_price_ordering_with_ties(self):
+        ids = self.collect('/api/services/?page_size=2&ordering=-price')
+        expected = list(Service.objects.order_by('-price', '-id').values_list('id', flat=True))
+        self.assertEqual(ids, expected)
+
+    def test_cursor_from_other_ordering_is_rejected(self):
+        response = self.client.get('/api/services/?page_size=2&ordering=price')
+        cursor = parse_qs(urlparse(response.data['next']).query)['cursor'][0]
+        response = self.client.get(f'/api/services/?ordering=-id&cursor={cursor}')
+        self.assertEqual(response.status_code, 404)
+
+    def test_tampered_cursor_is_rejected(self):
+        for ordering, values in (('-id', ['abc']), ('price', ['abc', 1]), ('price', [None, 1]), ('price', [1])):
+            cursor = base64.urlsafe_b64encode(json.dumps({'o': ordering, 'v': values}).encode()).decode()
+            response = self.client.get(f'/api/services/?ordering={ordering}&cursor={cursor}')
+            self.assertEqual(response.status_code, 404, (ordering, values))
+
+
+class QueryBudgetTests(TestCase):
+    """
+    Every list endpoint must run a fixed number of queries however many rows it
+    returns. Each case renders the list, adds more rows and renders it again.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(title='Ремонт')
+        cls.boost = Boost.objects.create(
+            name='Top 1 Day', boost_type='Top', duration_days=1, price=Decimal('1000.00'), applies_to='Service'
+        )
+        cls.phone_counter = 0
+
+    def setUp(self):
+        self.client = APIClient()
+
+    def make_user(self):
+        QueryBudgetTests.phone_counter += 1
+        return User.objects.create_user(phone=f'+99890{QueryBudgetTests.phone_counter:07d}')
+
+    def make_service(self):
+        sub_category = SubCategory.objects.create(title='Сантехника', category=self.category)
+        service = Service.objects.create(
+            title='Service', description='...', category=self.category,
+            executor=self.make_user(), price=Decimal('100.00'), boost=self.boost,
+        )
+        service.sub_categories.add(sub_category)
+        return service
+
+    def make_vacancy(self):
+        sub_category = SubCategory.objects.create(title='Электрика', category=self.category)
+        return Vacancy.objects.create(
+            title='Vacancy', description='...', price=Decimal('100.00'), category=self.category,
+            sub_category=sub_category, client=self.make_user(), boost=self.boost,
+        )
+
+    def assertQueryBudget(self, url, budget, make_row, rows=3):
+        for _ in range(2):
+            for _ in range(rows):
+                make_row()
+            cache.clear()
+            with CaptureQueriesContext(connection) as context:
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(response.data)
+            self.assertEqual(
+                len(context.captured_queries), budget,
+                f"{url} ran {len(context.captured_queries)} queries, budget is {budget}:\n"
+                + "\n".join(query['sql'] for query in context.captured_queries),
+            )
+
+    def test_services(self):
+        self.assertQueryBudget('/api/services/', 2, self.make_service)
+
+    def test_services_paginated(self):
+        self.assertQueryBudget('/api/services/?page_size=50', 2, self.make_service)
+
+    def test_vacancies(self):
+        self.assertQueryBudget('/api/vacancies/', 1, self.make_vacancy)
+
+    def test_subcategories(self):
+        self.assertQueryBudget('/api/subcategories/', 1, self.make_vacancy)
+
+    def test_service_boosts(self):
+        self.assertQueryBudget(
+            '/api/service-boosts/', 1,
+            lambda: ServiceBoost.objects.create(service=self.make_service(), boost=self.boost),
+        )
+
+    def test_vacancy_boosts(self):
+        self.assertQueryBudget(
+            '/api/vacancy-boosts/', 1,
+            lambda: VacancyBoost.objects.create(vacancy=self.make_vacancy(), boost=self.boost),
+        )
+
+    def test_users_summary(self):
+        self.assertQueryBudget('/api/users/', 1, self.make_service)
+
+    def test_users_expanded(self):
+        self.assertQueryBudget('/api/users/?expand=services,vacancies', 4, self.make_service)
+
+
+class SparseFieldsetTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(phone='+998901234567', name='Алишер')
+        category = Category.objects.create(title='Ремонт')
+        Service.objects.create(
+            title='Service', description='...', category=category, executor=cls.user, price=Decimal('100.00')
+        )
+
+    def setUp(self):
+        self.client = APIClient()
+
+    def test_user_list_is_summary(self):
+        row = self.client.get('/api/users/').data[0]
+        self.assertNotIn('services', row)
+        self.assertNotIn('telegram_id', row)
+        self.assertEqual(row['name'], 'Алишер')
+
+    def test_user_detail_has_all_scalar_fields(self):
+        data = self.client.get(f'/api/users/{self.user.id}/').data
+        self.assertIn('telegram_id', data)
+        self.assertNotIn('services', data)
+
+    def test_fields_and_expand(self):
+        row = self.client.get('/api/users/?fields=id,name&expand=services').data[0]
+        self.assertEqual(set(row), {'id', 'name', 'services'})
+        self.assertEqual(row['services'][0]['title'], 'Service')
+        self.assertIn('category_name', row['services'][0])
+
+    def test_fields_on_services(self):
+        row = self.client.get('/api/services/?fields=id,title').data[0]
+        self.assertEqual(set(row), {'id', 'title'})
+
+
+class BoostPriorityTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.executor = User.objects.create_user(phone='+998901234567')
+        cls.category = Category.objects.create(title='Ремонт')
+        cls.top = Boost.objects.create(
+            name='Top 1 Day', boost_type='Top', duration_days=1, price=Decimal('1000.00'), applies_to='Service'
+        )
+        cls.turbo = Boost.objects.create(
+            name='Turbo 7 Days', boost_type='Turbo', duration_days=7, price=Decimal('5000.00'), applies_to='Service'
+        )
+
+    def make_service(self, title, moderation='Approved'):
+        return Service.objects.create(
+            title=title, description='...', category=self.category, executor=self.executor,
+            price=Decimal('100.00'), moderation=moderation,
+        )
+
+    def test_priority_follows_boost_lifecycle(self):
+        service = self.make_service('Boosted')
+        service_boost = ServiceBoost.objects.create(service=service, boost=self.top, is_active=True)
+        service.refresh_from_db()
+        self.assertEqual(service.boost_priority, 1)
+
+        turbo_boost = ServiceBoost.objects.create(service=service, boost=self.turbo, is_active=True)
+        service.refresh_from_db()
+        self.assertEqual(service.boost_priority, 2)
+
+        turbo_boost.delete()
+        service.refresh_from_db()
+        self.assertEqual(service.boost_priority, 1)
+
+        service_boost.end_date = timezone.now() - timedelta(minutes=1)
+        service_boost.save()
+        service_boost.check_status()
+        service.refresh_from_db()
+        self.assertEqual(service.boost_priority, 0)
+
+    def test_feed_ranks_turbo_top_organic(self):
+        organic = self.make_service('Organic')
+        top = self.make_service('Top')
+        turbo = self.make_service('Turbo')
+        self.make_service('Pending', moderation='Pending')
+        ServiceBoost.objects.create(service=top, boost=self.top, is_active=True)
+        ServiceBoost.objects.create(service=turbo, boost=self.turbo, is_active=True)
+
+        client = APIClient()
+        response = client.get('/api/services/feed/?page_size=2')
+        ids = [row['id'] for row in response.data['results']]
+        response = client.get(response.data['next'])
+        ids += [row['id'] for row in response.data['results']]
+        self.assertEqual(ids, [turbo.id, top.id, organic.id])
+        self.assertIsNone(response.data['next'])
+
+    def test_expire_overdue(self):
+        expired = self.make_service('Expired')
+        live = self.make_service('Live')
+        overdue = ServiceBoost.objects.create(service=expired, boost=self.turbo, is_active=True)
+        ServiceBoost.objects.filter(pk=overdue.pk).update(end_date=timezone.now() - timedelta(minutes=1))
+        ServiceBoost.objects.create(service=live, boost=self.top, is_active=True)
+        Service.objects.filter(pk=expired.pk).update(boost_priority=2)
+
+        stats = BoostService.expire_overdue()
+
+        self.assertEqual(stats['services'], 1)
+        self.assertFalse(ServiceBoost.objects.get(pk=overdue.pk).is_active)
+        self.assertEqual(Service.objects.get(pk=expired.pk).boost_priority, 0)
+        self.assertEqual(Service.objects.get(pk=live.pk).boost_priority, 1)
+
+
+class CategoryServiceCountTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.executor = User.objects.create_user(phone='+998901234567')
+        cls.repair = Category.objects.create(title='Ремонт')
+        cls.cleaning = Category.objects.create(title='Уборка')
+
+    def count(self, category):
+        return Category.objects.get(pk=category.pk).service_count
+
+    def test_counter_follows_service_lifecycle(self):
+        service = Service.objects.create(
+            title='Service', description='...', category=self.repair, executor=self.executor, price=Decimal('100.00')
+        )
+        self.assertEqual(self.count(self.repair), 0)
+
+        service = Service.objects.get(pk=service.pk)
+        service.moderation = 'Approved'
+        service.save()
+        self.assertEqual(self.count(self.repair), 1)
+
+        service.category = self.cleaning
+        service.save()
+        self.assertEqual((self.count(self.repair), self.count(self.cleaning)), (0, 1))
+
+        Service.objects.get(pk=service.pk).delete()
+        self.assertEqual(self.count(self.cleaning), 0)
+
+    def test_recount_services(self):
+        for moderation in ('Approved', 'Approved', 'Pending'):
+            Service.objects.create(
+                title='Service', description='...', category=self.repair, executor=self.executor,
+                price=Decimal('100.00'), moderation=moderation,
+            )
+        Category.objects.update(service_count=42)
+        Category.recount_services()
+        self.assertEqual((self.count(self.repair), self.count(self.cleaning)), (2, 0))
+
+
+class UserRatingTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.executor = User.objects.create_user(phone='+998901234567')
+        cls.clients = [User.objects.create_user(phone=f'+99890765432{i}') for i in range(3)]
+
+    def review(self, client, rating):
+        order = Order.objects.create(client=client, executor=self.executor)
+        return ExecutorReview.objects.create(
+            order=order, executor=self.executor, client=client, rating=rating, review='...'
+        )
+
+    def test_incremental_average(self):
+        reviews = [self.review(client, rating) for client, rating in zip(self.clients, (5.0, 4.0, 3.0))]
+        self.executor.refresh_from_db()
+        self.assertEqual(self.executor.executor_rating_count, 3)
+        self.assertAlmostEqual(self.executor.executor_rating, 4.0)
+
+        reviews[0].delete()
+        self.executor.refresh_from_db()
+        self.assertAlmostEqual(self.executor.executor_rating, 3.5)
+
+        for review in reviews[1:]:
+            review.delete()
+        self.executor.refresh_from_db()
+        self.assertEqual((self.executor.executor_rating, self.executor.executor_rating_count), (0.0, 0))
+
+    def test_edits_move_the_rating(self):
+        review = self.review(self.clients[0], 5.0)
+        self.review(self.clients[1], 3.0)
+        review.rating = 1.0
+        review.save()
+        self.executor.refresh_from_db()
+        self.assertEqual((self.executor.executor_rating_count, self.executor.executor_rating), (2, 2.0))
+
+        other = User.objects.create_user(phone='+998901111111')
+        review.executor = other
+        review.save()
+        self.executor.refresh_from_db()
+        other.refresh_from_db()
+        self.assertEqual((self.executor.executor_rating_count, self.executor.executor_rating), (1, 3.0))
+        self.assertEqual((other.executor_rating_count, other.executor_rating), (1, 1.0))
+
+    def test_recompute_matches_incremental(self):
+        for client, rating in zip(self.clients, (5.0, 2.0)):
+            self.review(client, rating)
+        User.objects.filter(pk=self.executor.pk).update(
+            executor_rating=0.0, executor_rating_sum=0.0, executor_rating_count=0
+        )
+        User.recompute_ratings()
+        self.executor.refresh_from_db()
+        self.assertEqual(self.executor.executor_rating_count, 2)
+        self.assertAlmostEqual(self.executor.executor_rating_sum, 7.0)
+        self.assertAlmostEqual(self.executor.executor_rating, 3.5)
+
+
+class CatalogCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.category = Category.objects.create(title='Ремонт')
+
+    def test_cached_until_category_changes(self):
+        self.client.get('/api/categories/')
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/categories/')
+        self.assertEqual(response.data[0]['title'], 'Ремонт')
+
+        self.category.title = 'Уборка'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.category.save()
+        self.assertEqual(self.client.get('/api/categories/').data[0]['title'], 'Уборка')
+
+    def test_etag_not_modified(self):
+        etag = self.client.get('/api/boosts/')['ETag']
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/boosts/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Boost.objects.create(
+                name='Top 1 Day', boost_type='Top', duration_days=1, price=Decimal('1000.00'), applies_to='Service'
+            )
+        response = self.client.get('/api/boosts/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data), 1)
+
+    def test_bump_in_another_process_is_seen_after_the_timeout(self):
+        etag = self.client.get('/api/boosts/')['ETag']
+        other_worker = LocMemCache('other-worker', {})
+        with mock.patch('api.cache.cache', other_worker), self.captureOnCommitCallbacks(execute=True):
+            Boost.objects.create(
+                name='Top 1 Day', boost_type='Top', duration_days=1, price=Decimal('1000.00'), applies_to='Service'
+            )
+        self.assertEqual(self.client.get('/api/boosts/', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        later = time.time() + CATALOG_CACHE_TIMEOUT + 1
+        with mock.patch('django.core.cache.backends.locmem.time.time', return_value=later):
+            response = self.client.get('/api/boosts/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data), 1)
+
+
+class ActiveAdsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        now = timezone.now()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.tashkent = Ad.objects.create(image='ads/a.png', region='город ташкент, Unknown')
+            self.everywhere = Ad.objects.create(image='ads/b.png')
+            Ad.objects.create(image='ads/c.png', start_date=now + timedelta(days=1))
+            Ad.objects.create(image='ads/d.png', start_date=now - timedelta(days=2), end_date=now - timedelta(days=1))
+
+    def active_ids(self, url):
+        return {ad['id'] for ad in self.client.get(url).data}
+
+    def test_regions_are_parsed(self):
+        self.assertEqual(list(self.tashkent.regions.values_list('region', flat=True)), ['Город Ташкент'])
+
+    def test_unknown_regions_are_rejected(self):
+        with self.assertRaises(DjangoValidationError) as raised:
+            Ad(image='ads/e.png', region='Ташкент сити, город ташкент').full_clean()
+        self.assertIn('Ташкент сити', str(raised.exception.message_dict['region']))
+        Ad(image='ads/e.png', region='город ташкент').full_clean()
+
+    def test_filters_by_window_and_region(self):
+        self.assertEqual(self.active_ids('/api/ads/active/'), {self.everywhere.id})
+        self.assertEqual(
+            self.active_ids('/api/ads/active/?region=Город Ташкент'), {self.tashkent.id, self.everywhere.id}
+        )
+
+    def test_snapshot_refreshes_on_change(self):
+        self.client.get('/api/ads/active/')
+        with self.assertNumQueries(0):
+            self.client.get('/api/ads/active/')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.everywhere.delete()
+        self.assertEqual(self.active_ids('/api/ads/active/'), set())
+
+
+class DatabaseOTPStorageTests(TestCase):
+    storage_class = otp_storage.DatabaseOTPStorage
+    phone = '+998901234567'
+
+    def setUp(self):
+        cache.clear()
+        self.previous_storage = otp_storage._storage
+        otp_storage._storage = self.storage_class()
+
+    def tearDown(self):
+        otp_storage._storage = self.previous_storage
+
+    def test_resend_is_throttled(self):
+        OTPService.create_otp(self.phone)
+        with self.assertRaises(ValidationError) as raised:
+            OTPService.create_otp(self.phone)
+        self.assertGreater(int(raised.exception.detail['seconds_left']), 0)
+
+    def test_session_telegram_and_verify(self):
+        link = OTPService.create_otp(self.phone)['data']['link']
+        session_id = link.split('start=')[1]
+        otp = OTPService.get_otp_by_session_id(session_id)
+
+        success, _ = OTPService.attach_telegram_data(session_id, 12345, 'user')
+        self.assertTrue(success)
+        self.assertEqual(OTPService.get_latest_otp(self.phone).telegram_id, 12345)
+
+        self.assertFalse(OTPService.verify_otp(self.phone, 'wrong')[0])
+        self.assertTrue(OTPService.verify_otp(self.phone, otp.code)[0])
+
+        OTPService.delete_otp(OTPService.get_latest_otp(self.phone))
+        self.assertIsNone(OTPService.get_latest_otp(self.phone))
+
+
+class CacheOTPStorageTests(DatabaseOTPStorageTests):
+    storage_class = otp_storage.CacheOTPStorage
+
+    def test_nothing_is_written_to_the_database(self):
+        with self.assertNumQueries(0):
+            OTPService.create_otp(self.phone)
+
+
+class NotificationOutboxTests(TestCase):
+    def setUp(self):
+        self.executor = User.objects.create_user(phone='+998901234567')
+        self.category = Category.objects.create(title='Ремонт')
+
+    def create_service(self):
+        return APIClient().post('/api/services/', {
+            'executor': self.executor.id, 'category': self.category.id, 'sub_categories': [],
+            'title': 'Service', 'description': '...', 'price': '100.00',
+        }, format='json')
+
+    @mock.patch.object(vacancy_notification, 'BOT_SERVICE_TOKEN', 'token')
+    @mock.patch.object(vacancy_notification.NotificationDelivery, 'send')
+    def test_create_enqueues_instead_of_sending(self, send):
+        response = self.create_service()
+        self.assertEqual(response.status_code, 201)
+        send.assert_not_called()
+        item = NotificationOutbox.objects.get()
+        self.assertEqual((item.kind, item.payload['id']), ('service', response.data['id']))
+
+        stats = vacancy_notification.NotificationDelivery().deliver_batch()
+        self.assertEqual(stats['sent'], 1)
+        self.assertFalse(NotificationOutbox.objects.exists())
+
+    @mock.patch.object(vacancy_notification.NotificationDelivery, 'send', side_effect=requests.ConnectionError('down'))
+    def test_failures_back_off_and_open_the_circuit(self, send):
+        for i in range(3):
+            NotificationOutbox.objects.create(kind='service', payload={'id': i})
+        breaker = vacancy_notification.CircuitBreaker(threshold=2, reset_timeout=30)
+
+        stats = vacancy_notification.NotificationDelivery(breaker=breaker).deliver_batch()
+
+        self.assertEqual(stats, {'sent': 0, 'failed': 2, 'deferred': 1})
+        self.assertEqual(send.call_count, 2)
+        self.assertEqual(NotificationOutbox.objects.filter(attempts=1).count(), 2)
+        self.assertFalse(NotificationOutbox.objects.filter(next_attempt_at__lte=timezone.now()).exists())
+
+    @mock.patch.object(vacancy_notification.NotificationDelivery, 'send', side_effect=[KeyError('unknown'), None])
+    def test_unexpected_error_fails_only_its_row(self, send):
+        broken = NotificationOutbox.objects.create(kind='service', payload={'id': 1})
+        NotificationOutbox.objects.create(kind='service', payload={'id': 2})
+        breaker = vacancy_notification.CircuitBreaker(threshold=1)
+
+        stats = vacancy_notification.NotificationDelivery(breaker=breaker).deliver_batch()
+
+        self.assertEqual(stats, {'sent': 1, 'failed': 1, 'deferred': 0})
+        broken.refresh_from_db()
+        self.assertEqual((broken.attempts, broken.status), (1, 'pending'))
+        self.assertIn('KeyError', broken.last_error)
+        self.assertEqual(list(NotificationOutbox.objects.values_list('pk', flat=True)), [broken.pk])
+
+
+class ChatSocketTestCase(TransactionTestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(phone='+998901234567', name='Ali')
+
+    async def connect(self, room_name='room', **kwargs):
+        # channels.testing needs daphne, so drive the consumer through plain ASGI events
+        communicator = ApplicationCommunicator(consumers.ChatConsumer.as_asgi(), {
+            'type': 'websocket', 'path': f'/ws/chat/{room_name}/', 'user': self.user,
+            'url_route': {'kwargs': kwargs or {'room_name': room_name}},
+        })
+        await communicator.send_input({'type': 'websocket.connect'})
+        self.assertEqual((await communicator.receive_output(1))['type'], 'websocket.accept')
+        return communicator
+
+    async def send_json(self, communicator, data):
+        await communicator.send_input({'type': 'websocket.receive', 'text': json.dumps(data)})
+
+    async def receive_json(self, communicator):
+        return json.loads((await communicator.receive_output(1))['text'])
+
+    async def disconnect(self, communicator):
+        await communicator.send_input({'type': 'websocket.disconnect', 'code': 1000})
+        await communicator.wait(1)
+
+
+class ChatConsumerTests(ChatSocketTestCase):
+    @async_to_sync
+    async def send_messages(self, texts):
+        communicator = await self.connect()
+        for text in texts:
+            await self.send_json(communicator, {'type': 'message', 'message': text})
+            self.assertEqual((await self.receive_json(communicator))['message'], f'Ali: {text}')
+        await self.disconnect(communicator)
+
+    def test_room_is_resolved_once_per_connection(self):
+        with mock.patch.object(ChatRoom.objects, 'get_or_create', wraps=ChatRoom.objects.get_or_create) as resolve:
+            self.send_messages(['hi', 'there'])
+        self.assertEqual(resolve.call_count, 1)
+        self.assertEqual(list(Message.objects.values_list('content', flat=True)), ['hi', 'there'])
+
+    @override_settings(CHAT_WRITE_COALESCE_MS=200)
+    def test_writes_within_the_window_share_one_bulk_create(self):
+        @async_to_sync
+        async def send_from_two_connections():
+            first, second = await self.connect(), await self.connect()
+            # Both sends land in the coalescing window before either is written
+            await self.send_json(first, {'type': 'message', 'message': 'hi'})
+            await self.send_json(second, {'type': 'message', 'message': 'there'})
+            for communicator in (first, second):
+                received = {(await self.receive_json(communicator))['message'] for _ in range(2)}
+                self.assertEqual(received, {'Ali: hi', 'Ali: there'})
+                await self.disconnect(communicator)
+
+        consumers._coalescer = None
+        with mock.patch.object(Message.objects, 'bulk_create', wraps=Message.objects.bulk_create) as bulk_create:
+            send_from_two_connections()
+        consumers._coalescer = None
+        bulk_create.assert_called_once()
+        batch = bulk_create.call_args.args[0]
+        self.assertEqual(sorted(message.content for message in batch), ['hi', 'there'])
+        self.assertEqual(Message.objects.filter(room__name='room').count(), 2)
+        self.assertEqual(ChatRoom.objects.get(name='room').last_message_preview, batch[-1].content)
+
+    @async_to_sync
+    async def test_load_older_pages_through_history(self):
+        room = await ChatRoom.objects.acreate(name='room', user1=self.user, user2=self.user)
+        for i in range(5):
+            await Message.objects.acreate(room=room, sender=self.user, content=str(i))
+        communicator = await self.connect()
+
+        await self.send_json(communicator, {'type': 'load_older', 'limit': 3})
+        first = await self.receive_json(communicator)
+        await self.send_json(communicator, {'type': 'load_older', 'limit': 3, 'cursor': first['next']})
+        second = await self.receive_json(communicator)
+        await self.disconnect(communicator)
+
+        self.assertEqual([m['content'] for m in first['messages']], ['4', '3', '2'])
+        self.assertEqual([m['content'] for m in second['messages']], ['1', '0'])
+        self.assertIsNone(second['next'])
+
+    @async_to_sync
+    async def test_tampered_history_cursor_is_an_error(self):
+        communicator = await self.connect()
+        cursor = base64.urlsafe_b64encode(json.dumps({'o': 'newest', 'v': ['abc', 'x']}).encode()).decode()
+        await self.send_json(communicator, {'type': 'load_older', 'cursor': cursor})
+        reply = await self.receive_json(communicator)
+        await self.disconnect(communicator)
+        self.assertEqual(reply, {'type': 'history_error', 'error': 'Invalid cursor'})
+
+    @async_to_sync
+    async def test_history_is_refused_outside_the_room(self):
+        owner = await User.objects.acreate(phone='+998901234568', name='Vali')
+        room = await ChatRoom.objects.acreate(name='room', user1=owner, user2=owner)
+        await Message.objects.acreate(room=room, sender=owner, content='secret')
+        communicator = await self.connect()
+
+        await self.send_json(communicator, {'type': 'load_older'})
+        reply = await self.receive_json(communicator)
+        await self.disconnect(communicator)
+        self.assertEqual(reply['type'], 'history_error')
+        self.assertNotIn('messages', reply)
+
+    @async_to_sync
+    async def test_read_is_ignored_outside_the_room(self):
+        owner = await User.objects.acreate(phone='+998901234568', name='Vali')
+        room = await ChatRoom.objects.acreate(name='room', user1=owner, user2=owner)
+        message = await Message.objects.acreate(room=room, sender=owner, content='hi')
+        communicator = await self.connect()
+        await self.send_json(communicator, {'type': 'read', 'message_id': message.id})
+        await self.disconnect(communicator)
+        self.assertFalse(await ChatMembership.objects.filter(user=self.user).aexists())
+
+    @async_to_sync
+    async def test_direct_room_is_shared_by_the_pair(self):
+        other = await User.objects.acreate(phone='+998901234568', name='Vali')
+        first = await self.connect(user_id=other.id)
+        await self.send_json(first, {'type': 'message', 'message': 'hi'})
+        await self.receive_json(first)
+        await self.disconnect(first)
+
+        self.user = other
+        second = await self.connect(user_id=(await User.objects.aget(name='Ali')).id)
+        await self.send_json(second, {'type': 'load_older'})
+        history = await self.receive_json(second)
+        await self.disconnect(second)
+
+        room = await ChatRoom.objects.aget()
+        self.assertTrue(room.is_direct)
+        self.assertEqual([m['content'] for m in history['messages']], ['hi'])
+
+    @async_to_sync
+    async def test_read_receipt_is_broadcast(self):
+        communicator = await self.connect()
+        await self.send_json(communicator, {'type': 'message', 'message': 'hi'})
+        message_id = (await self.receive_json(communicator))['message_id']
+        await self.send_json(communicator, {'type': 'read', 'message_id': message_id})
+        receipt = await self.receive_json(communicator)
+        await self.disconnect(communicator)
+        self.assertEqual(receipt, {'type': 'read', 'user_id': self.user.id, 'last_read_message_id': message_id})
+
+
+class ChatHistoryTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(phone='+998901234567')
+        cls.other = User.objects.create_user(phone='+998901234568')
+        cls.room = ChatRoom.objects.create(name='room', user1=cls.user, user2=cls.other)
+        for i in range(7):
+            Message.objects.create(room=cls.room, sender=cls.user, content=str(i))
+
+    def test_history_seeks_with_a_fixed_query_count(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        url, contents = f'/api/chat-rooms/{self.room.id}/messages/?page_size=3', []
+        while url:
+            with self.assertNumQueries(2):
+                response = client.get(url)
+            contents += [m['content'] for m in response.data['results']]
+            url = response.data['next']
+        self.assertEqual(contents, [str(i) for i in reversed(range(7))])
+
+    def test_direct_room_is_unique_per_pair(self):
+        first = ChatRoom.get_direct(self.user.id, self.other.id)
+        with self.assertNumQueries(1):
+            self.assertEqual(ChatRoom.get_direct(self.other.id, self.user.id), first)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            ChatRoom.objects.create(is_direct=True, user1=self.user, user2=self.other)
+        with self.assertRaises(ValueError):
+            ChatRoom.get_direct(self.user.id, self.user.id)
+
+    def test_history_is_limited_to_participants(self):
+        client = APIClient()
+        client.force_authenticate(User.objects.create_user(phone='+998901234569'))
+        self.assertEqual(client.get(f'/api/chat-rooms/{self.room.id}/messages/').status_code, 404)
+
+    def test_read_moves_the_watermark_in_one_write(self):
+        client = APIClient()
+        client.force_authenticate(self.other)
+        messages = list(self.room.messages.order_by('id'))
+        self.assertEqual(ChatMembership.unread_count(self.room.id, self.other.id), 7)
+
+        response = client.post(f'/api/chat-rooms/{self.room.id}/read/', {'message_id': messages[4].id})
+        self.assertEqual(response.data['unread_count'], 2)
+        with self.assertNumQueries(1):
+            messages[6].mark_as_read(self.other)
+        messages[2].mark_as_read(self.other)
+
+        self.assertEqual(ChatMembership.objects.get(user=self.other).last_read_message_id, messages[6].id)
+        self.assertEqual(ChatMembership.unread_count(self.room.id, self.other.id), 0)
+        self.assertEqual(ChatMembership.unread_count(self.room.id, self.user.id), 0)
+
+    def test_inbox_is_a_single_query(self):
+        client = APIClient()
+        client.force_authenticate(self.other)
+        quiet = ChatRoom.objects.create(name='quiet', user1=self.user, user2=self.other)
+        ChatMembership.mark_read(self.room.id, self.other.id, self.room.messages.order_by('id')[4].id)
+
+        with self.assertNumQueries(1):
+            inbox = client.get('/api/chat-rooms/inbox/').data
+        self.assertEqual([room['id'] for room in inbox], [self.room.id, quiet.id])
+        self.assertEqual((inbox[0]['last_message_preview'], inbox[0]['unread_count']), ('6', 2))
+        self.assertEqual((inbox[1]['last_message_id'], inbox[1]['unread_count']), (None, 0))
+
+        self.room.messages.order_by('-id').first().delete()
+        self.assertEqual(client.get('/api/chat-rooms/inbox/').data[0]['last_message_preview'], '5')
+
+
+class JWTAuthMiddlewareTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(phone='+998901234567', name='Ali')
+        self.token = str(RefreshToken.for_user(self.user).access_token)
+
+    @async_to_sync
+    async def authenticate(self, **scope):
+        seen = {}
+
+        async def inner(scope, receive, send):
+            seen.update(scope)
+
+        await JWTAuthMiddleware(inner)({'type': 'websocket', **scope}, None, None)
+        return seen
+
+    def test_token_from_query_string_or_subprotocol(self):
+        scope = self.authenticate(query_string=f'token={self.token}'.encode())
+        self.assertEqual((scope['user'].id, scope['user'].name), (self.user.id, 'Ali'))
+
+        scope = self.authenticate(subprotocols=['Bearer', self.token])
+        self.assertEqual((scope['user'].id, scope['jwt_subprotocol']), (self.user.id, 'Bearer'))
+
+        self.assertTrue(self.authenticate(query_string=b'token=garbage')['user'].is_anonymous)
+        self.assertTrue(self.authenticate()['user'].is_anonymous)
+
+    def test_user_lookup_is_cached(self):
+        with self.assertNumQueries(1):
+            self.authenticate(query_string=f'token={self.token}'.encode())
+            self.authenticate(query_string=f'token={self.token}'.encode())
+
+        with self.settings(CHAT_JWT_USER_CACHE_TTL=0), self.assertNumQueries(0):
+            self.assertEqual(self.authenticate(subprotocols=['Bearer', self.token])['user'].id, self.user.id)
+
+
+@override_settings(
+    MEDIA_ROOT=tempfile.mkdtemp(), CHAT_UPLOAD_TEMP_DIR=tempfile.mkdtemp(), CHAT_UPLOAD_CHUNK_SIZE=4,
+)
+class ChatUploadTests(ChatSocketTestCase):
+    async def start_upload(self, communicator, **data):
+        await self.send_json(communicator, {'type': 'file_start', 'file_name': 'notes.txt', 'size': 10, **data})
+        return await self.receive_json(communicator)
+
+    async def send_chunk(self, communicator, chunk):
+        await communicator.send_input({'type': 'websocket.receive', 'bytes': chunk})
+        return await self.receive_json(communicator)
+
+    @async_to_sync
+    async def test_chunked_upload_resumes_from_offset(self):
+        communicator = await self.connect()
+        ready = await self.start_upload(communicator)
+        self.assertEqual(ready['offset'], 0)
+        self.assertEqual((await self.send_chunk(communicator, b'0123'))['offset'], 4)
+        self.assertEqual((await self.send_chunk(communicator, b'too long'))['type'], 'file_error')
+        await self.disconnect(communicator)
+
+        communicator = await self.connect()
+        resumed = await self.start_upload(communicator, upload_id=ready['upload_id'])
+        self.assertEqual((resumed['upload_id'], resumed['offset']), (ready['upload_id'], 4))
+        await self.send_chunk(communicator, b'4567')
+        self.assertEqual((await self.send_chunk(communicator, b'89'))['offset'], 10)
+        event = await self.receive_json(communicator)
+        await self.disconnect(communicator)
+
+        message = await Message.objects.aget(pk=event['message_id'])
+        with message.file.open('rb') as f:
+            self.assertEqual(f.read(), b'0123456789')
+
+    @async_to_sync
+    async def test_oversized_file_is_rejected(self):
+        communicator = await self.connect()
+        with self.settings(CHAT_UPLOAD_MAX_SIZE=5):
+            self.assertEqual((await self.start_upload(communicator))['type'], 'file_error')
+        await self.disconnect(communicator)
+
+    def test_pending_uploads_are_capped_and_stale_ones_swept(self):
+        with self.settings(CHAT_UPLOAD_TEMP_DIR=tempfile.mkdtemp(), CHAT_UPLOAD_MAX_PENDING=2):
+            uploads = [ChunkedUpload.start(self.user.id, 1, 'notes.txt', 10) for _ in range(2)]
+            with self.assertRaises(UploadError):
+                ChunkedUpload.start(self.user.id, 1, 'notes.txt', 10)
+
+            # Abandoned past CHAT_UPLOAD_TTL: swept by the next start, unless a connection still holds it
+            old = time.time() - settings.CHAT_UPLOAD_TTL - 1
+            for upload in uploads:
+                os.utime(upload.path, (old, old))
+            uploads[0].release()
+            ChunkedUpload.start(self.user.id, 1, 'notes.txt', 10)
+            self.assertFalse(os.path.exists(uploads[0].path))
+            self.assertFalse(os.path.exists(uploads[0].meta_path))
+            self.assertTrue(os.path.exists(uploads[1].path))
+            self.assertEqual(ChunkedUpload.pending_count(self.user.id), 2)
+
+    def test_upload_is_resumable_by_one_connection_at_a_time(self):
+        upload = ChunkedUpload.start(self.user.id, 1, 'notes.txt', 10)
+        upload.append(b'0123')
+
+        # Another worker finds the metadata on disk, but not while the upload is held
+        with self.assertRaises(UploadError):
+            ChunkedUpload.start(self.user.id, 1, None, None, upload.upload_id)
+        upload.release()
+        resumed = ChunkedUpload.start(self.user.id, 1, None, None, upload.upload_id)
+        self.assertEqual((resumed.file_name, resumed.offset), ('notes.txt', 4))
+        resumed.discard()
+
+        # Unknown or malformed ids start a new upload instead
+        fresh = ChunkedUpload.start(self.user.id, 1, 'notes.txt', 10, '../' + upload.upload_id)
+        self.assertNotEqual(fresh.upload_id, upload.upload_id)
+        fresh.discard()
+
+
+def es_hits(*sources, timed_out=False):
+    return {
+        'took': 1, 'timed_out': timed_out, '_shards': {'total': 1, 'successful': 1, 'failed': 0},
+        'hits': {'total': {'value': len(sources), 'relation': 'eq'}, 'max_score': 1.0, 'hits': [
+            {'_index': 'x', '_id': str(source['id']), '_score': 1.0, '_source': source} for source in sources
+        ]},
+    }
+
+
+class GlobalSearchTests(TestCase):
+    def search(self, responses):
+        es = mock.Mock()
+        es.msearch.return_value = {'responses': responses}
+        with mock.patch('elasticsearch_dsl.search.get_connection', return_value=es):
+            response = APIClient().get('/api/search/', {'q': 'ремонт'})
+        return es, response
+
+    def test_sections_share_one_msearch_and_degrade_independently(self):
+        es, response = self.search([
+            es_hits({'id': 1, 'title': 'Ремонт', 'display_ru': 'Ремонт', 'display_uz': "Ta'mir"}),
+            {'error': {'type': 'index_not_found_exception', 'reason': 'no such index'}, 'status': 404},
+            es_hits(timed_out=True),
+            es_hits({'id': 7, 'title': 'Сантехник', 'description': '...', 'price': 100}),
+        ])
+
+        es.msearch.assert_called_once()
+        body = es.msearch.call_args.kwargs['body']
+        self.assertEqual([header['index'][0] for header in body[::2]], ['categories', 'sub_categories', 'vacancies', 'services'])
+        self.assertEqual({(part['size'], part['timeout']) for part in body[1::2]}, {(5, '300ms')})
+
+        data = response.data
+        self.assertEqual(data['results']['categories'][0]['title'], 'Ремонт')
+        self.assertEqual(data['results']['sub_categories'], [])
+        self.assertEqual(data['results']['services'][0]['id'], 7)
+        self.assertEqual((data['partial'], data['failed'], data['timed_out']), (True, ['sub_categories'], ['vacancies']))
+
+    def test_listing_filters_are_unscored_clauses_with_facets(self):
+        facets = {
+            'aggregations': {
+                'category': {'buckets': [{'key': 3, 'doc_count': 2}]},
+                'region': {'buckets': [{'key': 'Город Ташкент', 'doc_count': 2}]},
+                'price': {'count': 2, 'min': 100.0, 'max': 250.0, 'avg': 175.0, 'sum': 350.0},
+            },
+        }
+        es = mock.Mock()
+        es.msearch.return_value = {'responses': [es_hits(), es_hits(), es_hits(), {**es_hits(), **facets}]}
+        with mock.patch('elasticsearch_dsl.search.get_connection', return_value=es):
+            response = APIClient().get('/api/search/', {
+                'q': 'ремонт', 'category': '3,4', 'region': 'Город Ташкент', 'price_min': '100', 'min_rating': '4',
+            })
+
+        categories, _, vacancies, services = es.msearch.call_args.kwargs['body'][1::2]
+        self.assertNotIn('aggs', categories)
+        self.assertEqual(categories['query'], {'multi_match': vacancies['query']['bool']['must'][0]['multi_match']})
+        self.assertEqual(services['query']['bool']['filter'], [
+            {'terms': {'category_id': [3, 4]}},
+            {'terms': {'region': ['Город Ташкент']}},
+            {'range': {'price': {'gte': 100.0}}},
+            {'range': {'rating': {'gte': 4.0}}},
+        ])
+        self.assertEqual(services['aggs']['category'], {'terms': {'field': 'category_id', 'size': 20}})
+        self.assertEqual(response.data['facets']['services']['category'], [{'value': 3, 'count': 2}])
+        self.assertEqual(response.data['facets']['services']['price']['max'], 250.0)
+        self.assertEqual(response.data['facets']['vacancies'], {})
+
+    def test_boosted_ranking_scores_listings_in_elasticsearch(self):
+        es = mock.Mock()
+        es.msearch.return_value = {'responses': [es_hits(), es_hits(), es_hits(), es_hits()]}
+        with mock.patch('elasticsearch_dsl.search.get_connection', return_value=es):
+            APIClient().get('/api/search/', {'q': 'ремонт', 'ranking': 'boosted'})
+
+        categories, _, _, services = es.msearch.call_args.kwargs['body'][1::2]
+        self.assertIn('multi_match', categories['query'])
+        function_score = services['query']['function_score']
+        self.assertEqual((function_score['score_mode'], function_score['boost_mode']), ('multiply', 'multiply'))
+        self.assertEqual(
+            [function.get('weight') for function in function_score['functions']], [2, 3, None]
+        )
+        self.assertEqual(function_score['functions'][-1]['field_value_factor']['field'], 'rating')
+
+    def test_malformed_filter_is_rejected(self):
+        response = APIClient().get('/api/search/', {'q': 'ремонт', 'category': 'abc'})
+        self.assertEqual(response.status_code, 400)
+
+
+class SuggestTests(TestCase):
+    def setUp(self):
+        suggest.suggest_cache.clear()
+
+    def test_suggestions_come_from_the_completion_suggester_and_are_cached(self):
+        es = mock.Mock()
+        es.search.return_value = {
+            **es_hits(),
+            'suggest': {'suggest': [{'text': 'рем', 'offset': 0, 'length': 3, 'options': [
+                {'text': 'Ремонт', '_index': 'categories_0123456789ab', '_id': '3', '_score': 1.0},
+                {'text': 'Ремонт квартир', '_index': 'services_0123456789ab_1700000000', '_id': '9', '_score': 1.0},
+            ]}]},
+        }
+        with mock.patch('elasticsearch_dsl.search.get_connection', return_value=es):
+            first = APIClient().get('/api/search/suggest/', {'q': 'Рем '}).data
+            second = APIClient().get('/api/search/suggest/', {'q': 'рем'}).data
+
+        es.search.assert_called_once()
+        body = es.search.call_args.kwargs
+        self.assertEqual(body.get('body', body)['suggest']['suggest']['completion']['field'], 'suggest')
+        self.assertEqual(first['suggestions'], second['suggestions'])
+        self.assertEqual(first['suggestions'], [
+            {'text': 'Ремонт', 'type': 'categories', 'id': 3},
+            {'text': 'Ремонт квартир', 'type': 'services', 'id': 9},
+        ])
+
+    def test_inputs_cover_every_display_name(self):
+        category = Category(title='Ремонт', display_ru='Ремонт', display_uz="Ta'mirlash")
+        self.assertEqual(CategoryDocument().prepare_suggest(category), ['Ремонт', "Ta'mirlash"])
+
+
+@override_settings(ELASTICSEARCH_DSL_AUTOSYNC=True)
+class SearchQueueTests(TestCase):
+    def setUp(self):
+        self.executor = User.objects.create_user(phone='+998901234567')
+        self.category = Category.objects.create(title='Ремонт')
+        SearchIndexQueue.objects.all().delete()
+
+    def create_service(self, title='Service', moderation='Approved'):
+        return Service.objects.create(
+            title=title, description='...', category=self.category, executor=self.executor,
+            price=Decimal('100.00'), moderation=moderation,
+        )
+
+    @mock.patch('api.search.signals.bulk', return_value=(0, []))
+    @mock.patch.object(ServiceDocument, 'update')
+    def test_changes_are_debounced_into_one_bulk_flush(self, update, bulk):
+        service, removed = self.create_service(), self.create_service('Removed')
+        service.title = 'Renamed'
+        service.save()
+        removed_id = removed.id
+        removed.delete()
+
+        self.assertEqual(SearchIndexQueue.objects.filter(model='api.service').count(), 2)
+        self.assertEqual(flush_search_queue(debounce=60), 0)
+        update.assert_not_called()
+
+        self.assertEqual(flush_search_queue(debounce=0), 2)
+        update.assert_called_once()
+        self.assertEqual([obj.title for obj in update.call_args.args[0]], ['Renamed'])
+        self.assertEqual([action['_id'] for action in bulk.call_args.args[1]], [removed_id])
+        self.assertFalse(SearchIndexQueue.objects.exists())
+
+    def test_boost_expiry_and_reviews_queue_the_listing(self):
+        service = self.create_service()
+        boost = Boost.objects.create(
+            name='Turbo 7 Days', boost_type='Turbo', duration_days=7, price=Decimal('5000.00'), applies_to='Service'
+        )
+        running = ServiceBoost.objects.create(service=service, boost=boost, is_active=True)
+        document = ServiceDocument()
+        indexed = document.get_queryset().get(pk=service.pk)
+        self.assertEqual(document.prepare_boost_tier(indexed), 'Turbo')
+        self.assertEqual(document.prepare_boost_ends_at(indexed), running.end_date)
+
+        SearchIndexQueue.objects.all().delete()
+        BoostService.expire_overdue(now=running.end_date + timedelta(minutes=1))
+        self.assertTrue(SearchIndexQueue.objects.filter(model='api.service', object_id=service.pk).exists())
+        self.assertIsNone(document.prepare_boost_tier(document.get_queryset().get(pk=service.pk)))
+
+        SearchIndexQueue.objects.all().delete()
+        client = User.objects.create_user(phone='+998901234568')
+        order = Order.objects.create(client=client, executor=self.executor)
+        ExecutorReview.objects.create(order=order, executor=self.executor, client=client, rating=5.0, review='...')
+        self.assertTrue(SearchIndexQueue.objects.filter(model='api.service', object_id=service.pk).exists())
+
+    @mock.patch('api.search.signals.bulk', return_value=(0, []))
+    @mock.patch.object(ServiceDocument, 'update')
+    def test_only_approved_listings_are_indexed_with_their_category(self, update, bulk):
+        approved, pending = self.create_service('Approved'), self.create_service('Pending', moderation='Pending')
+        sub_category = SubCategory.objects.create(title='Сантехника', category=self.category)
+        approved.sub_categories.add(sub_category)
+        SearchIndexQueue.objects.filter(model='api.subcategory').delete()
+        flush_search_queue(debounce=0)
+
+        self.assertEqual([obj.pk for obj in update.call_args.args[0]], [approved.pk])
+        self.assertEqual([action['_id'] for action in bulk.call_args.args[1]], [pending.pk])
+
+        document = ServiceDocument()
+        indexed = document.get_queryset().get()
+        self.assertEqual(document.prepare_category(indexed)['title'], 'Ремонт')
+        self.assertEqual([item['id'] for item in document.prepare_sub_categories(indexed)], [sub_category.pk])
+        self.assertIsNone(document.prepare_image(indexed))
+
+    @mock.patch.object(CategoryDocument, 'update')
+    def test_category_rename_is_copied_into_listings_by_query(self, update):
+        es = mock.Mock()
+        es.update_by_query.return_value = {'updated': 3, 'noops': 0, 'failures': []}
+        self.category.display_ru = 'Ремонт и отделка'
+        self.category.save()
+        with mock.patch.object(ServiceDocument, '_get_connection', return_value=es), \
+                mock.patch.object(VacancyDocument, '_get_connection', return_value=es):
+            flush_search_queue(debounce=0)
+
+        update.assert_called_once()
+        self.assertEqual(
+            sorted(call.kwargs['index'][0] for call in es.update_by_query.call_args_list), ['services', 'vacancies']
+        )
+        body = es.update_by_query.call_args.kwargs['body']
+        self.assertEqual(body['query'], {'terms': {'category.id': [self.category.pk]}})
+        self.assertEqual(body['script']['params']['objects'][str(self.category.pk)]['display_ru'], 'Ремонт и отделка')
+
+    @mock.patch.object(ServiceDocument, 'update')
+    def test_another_save_pushes_the_flush_back(self, update):
+        service = self.create_service()
+        SearchIndexQueue.objects.update(queued_at=timezone.now() - timedelta(seconds=90))
+        service.title = 'Renamed'
+        service.save()
+
+        self.assertEqual(SearchIndexQueue.objects.count(), 1)
+        self.assertEqual(flush_search_queue(debounce=60), 0)
+        update.assert_not_called()
+        self.assertEqual(flush_search_queue(debounce=0), 1)
+
+    @mock.patch.object(ServiceDocument, 'update')
+    def test_flush_waits_for_a_running_reindex(self, update):
+        self.create_service()
+        hold = SearchReindexHold.objects.create(expires_at=timezone.now() + timedelta(hours=1))
+        self.assertEqual(flush_search_queue(debounce=0), 0)
+        self.assertEqual(SearchIndexQueue.objects.count(), 1)
+
+        # A reindex that died without releasing its hold stops blocking once it expires
+        hold.expires_at = timezone.now() - timedelta(seconds=1)
+        hold.save()
+        self.assertEqual(flush_search_queue(debounce=0), 1)
+        update.assert_called_once()
+
+    @mock.patch.object(ServiceDocument, 'update', side_effect=ConnectionError('down'))
+    def test_failed_flush_requeues(self, update):
+        self.create_service()
+        with self.assertRaises(ConnectionError):
+            flush_search_queue(debounce=0)
+        self.assertEqual(SearchIndexQueue.objects.filter(model='api.service').count(), 1)
+
+
+class ReindexTests(TestCase):
+    def setUp(self):
+        Category.objects.create(title='Ремонт')
+        Category.objects.create(title='Уборка')
+        self.target = f'categories_{mapping_hash(CategoryDocument)}'
+
+    def reindex(self, es, **kwargs):
+        sent = []
+        with mock.patch.object(CategoryDocument, '_get_connection', return_value=es), \
+                mock.patch('api.search.reindex.parallel_bulk', side_effect=lambda es, actions, **kw: sent.extend(actions) or []):
+            result = Reindexer(chunk_size=1).run([CategoryDocument], **kwargs)
+        return result['categories'], sent
+
+    def test_rebuild_swaps_alias_atomically(self):
+        es = mock.MagicMock()
+        es.indices.exists_alias.return_value = True
+        es.indices.get_alias.return_value = {'categories_old': {}}
+        es.indices.exists.return_value = False
+
+        status, sent = self.reindex(es)
+
+        self.assertEqual(status, 'rebuilt')
+        self.assertEqual({action['_index'] for action in sent}, {self.target})
+        self.assertEqual(len(sent), 2)
+        es.indices.update_aliases.assert_called_once_with(body={'actions': [
+            {'remove': {'index': 'categories_old', 'alias': 'categories'}},
+            {'add': {'index': self.target, 'alias': 'categories'}},
+        ]})
+        es.indices.delete.assert_called_once_with(index='categories_old', ignore_unavailable=True)
+        self.assertFalse(SearchReindexHold.objects.exists())
+
+    def test_forced_rebuild_of_unchanged_mapping_keeps_serving_the_old_index(self):
+        es = mock.MagicMock()
+        es.indices.exists_alias.return_value = True
+        es.indices.get_alias.return_value = {self.target: {}}
+        es.indices.exists.return_value = False
+
+        with mock.patch('api.search.reindex.time.time', return_value=1700000000):
+            status, sent = self.reindex(es, force=True)
+
+        fresh = f'{self.target}_1700000000'
+        self.assertEqual(status, 'rebuilt')
+        self.assertEqual({action['_index'] for action in sent}, {fresh})
+        es.indices.update_aliases.assert_called_once_with(body={'actions': [
+            {'remove': {'index': self.target, 'alias': 'categories'}},
+            {'add': {'index': fresh, 'alias': 'categories'}},
+        ]})
+        self.assertEqual(
+            [name for name, *_ in es.method_calls if name.startswith('indices.')][-1], 'indices.delete'
+        )
+        es.indices.delete.assert_called_once_with(index=self.target, ignore_unavailable=True)
+
+    def test_unchanged_mapping_is_skipped(self):
+        es = mock.MagicMock()
+        es.indices.exists_alias.return_value = True
+        es.indices.get_alias.return_value = {self.target: {}}
+
+        status, sent = self.reindex(es)
+
+        self.assertEqual((status, sent), ('unchanged', []))
+        es.indices.update_aliases.assert_not_called()
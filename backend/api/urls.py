@@ -8,7 +8,7 @@ from .views import (
     PaymentViewSet, AdViewSet, OrderReviewsView, BoostViewSet,
     ServiceBoostViewSet, VacancyBoostViewSet,
     RequestOTPView, VerifyOTPView, RegisterView, LoginView, LogoutView, CheckAuthView, BoostPaymentCreateView,
-    GetOTPBySessionView, AttachTelegramView
+    GetOTPBySessionView, AttachTelegramView, ChatRoomViewSet
 )
 
 router = DefaultRouter()
@@ -26,6 +26,7 @@ router.register(r'order-reviews', OrderReviewsView, basename='order-reviews')
 router.register(r'boosts', BoostViewSet, basename='boosts')
 router.register(r'service-boosts', ServiceBoostViewSet, basename='service-boosts')
 router.register(r'vacancy-boosts', VacancyBoostViewSet, basename='vacancy-boosts')
+router.register(r'chat-rooms', ChatRoomViewSet, basename='chat-rooms')
 
 urlpatterns = [
     path('', include(router.urls)),
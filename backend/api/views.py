@@ -1,6 +1,10 @@
 import logging
 
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.core.cache import cache
 from django.core.exceptions import ValidationError
+from django.db import transaction
 from payme.models import PaymeTransactions
 from payme.types import response
 from rest_framework.decorators import action
@@ -18,67 +22,134 @@ from payme.views import PaymeWebHookAPIView
 
 from .models import (
     User, Category, SubCategory, Service, ExecutorReview, Vacancy, ClientReview, Ad, OrderReview, Boost, ServiceBoost,
-    VacancyBoost, Order, OTP_table
+    VacancyBoost, Order, OTP_table, ChatRoom, ChatMembership
 )
 
 from .serializers import (
     UserSerializer, CategorySerializer, SubCategorySerializer, ServiceSerializer, ExecutorReviewSerializer,
     VacancySerializer, ClientReviewSerializer, AdSerializer, OrderReviewSerializer, BoostSerializer,
     ServiceBoostSerializer, VacancyBoostSerializer, RequestOTPSerializer, VerifyOTPSerializer, RegisterSerializer,
-    LoginSerializer, ResetPasswordSerializer, OrderSerializer, PaymentSerializer
+    LoginSerializer, ResetPasswordSerializer, OrderSerializer, PaymentSerializer, ChatRoomSerializer,
+    MessageSerializer, InboxSerializer
 )
 
+from .cache import CATALOG_CACHE_TIMEOUT, get_catalog_version, catalog_cache_key
+from .pagination import KeysetPagination, RankedFeedPagination, ChatHistoryPagination
 from .permissions import IsOwner
 
+from .services.ad_service import AdService
 from .services.otp_service import OTPService
 from .services.payme_service  import PaymeService, payme
 from .services.user_service import UserService
-from .services.vacancy_notification import notify_vacancy, notify_service
+from .services.vacancy_notification import enqueue_vacancy, enqueue_service
 
 logger = logging.getLogger("app")
 
 # --- ViewSets ---
 
-class UserViewSet(viewsets.ModelViewSet):
+class EagerLoadingViewSetMixin:
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        return self.get_serializer_class().setup_eager_loading(queryset, self.request)
+
+
+class CatalogCacheMixin:
+    """
+    Serves list/retrieve responses from the cache under a per-namespace version
+    that model signals bump on every change, and answers matching
+    If-None-Match requests with 304 without touching the database.
+    """
+    cache_namespace = None
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(super().retrieve, request, *args, **kwargs)
+
+    def cached_response(self, handler, request, *args, **kwargs):
+        version = get_catalog_version(self.cache_namespace)
+        key, etag = catalog_cache_key(self.cache_namespace, version, request.build_absolute_uri())
+
+        if_none_match = request.headers.get('If-None-Match', '')
+        if etag in [tag.strip() for tag in if_none_match.split(',')]:
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+
+        data = cache.get(key)
+        if data is not None:
+            return Response(data, headers={'ETag': etag})
+
+        response = handler(request, *args, **kwargs)
+        if response.status_code == status.HTTP_200_OK:
+            cache.set(key, response.data, CATALOG_CACHE_TIMEOUT)
+            response['ETag'] = etag
+        return response
+
+class UserViewSet(EagerLoadingViewSetMixin, viewsets.ModelViewSet):
     queryset = User.objects.all()
     serializer_class = UserSerializer
 
-class CategoryViewSet(viewsets.ModelViewSet):
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['summary'] = self.action == 'list'
+        return context
+
+class CategoryViewSet(CatalogCacheMixin, EagerLoadingViewSetMixin, viewsets.ModelViewSet):
     queryset = Category.objects.all()
     serializer_class = CategorySerializer
+    cache_namespace = 'categories'
 
 
-class SubCategoryViewSet(viewsets.ModelViewSet):
+class SubCategoryViewSet(CatalogCacheMixin, EagerLoadingViewSetMixin, viewsets.ModelViewSet):
     queryset = SubCategory.objects.all()
     serializer_class = SubCategorySerializer
+    cache_namespace = 'subcategories'
 
 
-class ServiceViewSet(viewsets.ModelViewSet):
+class ServiceViewSet(EagerLoadingViewSetMixin, viewsets.ModelViewSet):
     queryset = Service.objects.all()
     serializer_class = ServiceSerializer
+    pagination_class = KeysetPagination
 
     def perform_create(self, serializer):
-        service = serializer.save()
+        with transaction.atomic():
+            service = serializer.save()
+            enqueue_service(service)
         logger.info(f"Создан сервис {service.id} от пользователя {service.executor}")
-        notify_service(service)
 
+    @action(detail=False, methods=['get'], pagination_class=RankedFeedPagination)
+    def feed(self, request):
+        queryset = self.get_queryset().filter(moderation='Approved')
+        page = self.paginate_queryset(queryset)
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
 
-class ExecutorReviewViewSet(viewsets.ModelViewSet):
+
+class ExecutorReviewViewSet(EagerLoadingViewSetMixin, viewsets.ModelViewSet):
     queryset = ExecutorReview.objects.all()
     serializer_class = ExecutorReviewSerializer
 
 
-class VacancyViewSet(viewsets.ModelViewSet):
+class VacancyViewSet(EagerLoadingViewSetMixin, viewsets.ModelViewSet):
     queryset = Vacancy.objects.all()
     serializer_class = VacancySerializer
+    pagination_class = KeysetPagination
 
     def perform_create(self, serializer):
-        vacancy = serializer.save()
+        with transaction.atomic():
+            vacancy = serializer.save()
+            enqueue_vacancy(vacancy)
         logger.info(f"Создана вакансия {vacancy.id} от пользователя {vacancy.client}")
-        notify_vacancy(vacancy)
+
+    @action(detail=False, methods=['get'], pagination_class=RankedFeedPagination)
+    def feed(self, request):
+        queryset = self.get_queryset().filter(moderation='approved')
+        page = self.paginate_queryset(queryset)
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
 
 
-class ClientReviewViewSet(viewsets.ModelViewSet):
+class ClientReviewViewSet(EagerLoadingViewSetMixin, viewsets.ModelViewSet):
     queryset = ClientReview.objects.all()
     serializer_class = ClientReviewSerializer
 
@@ -96,29 +167,89 @@ class PaymentViewSet(viewsets.ModelViewSet):
     serializer_class = PaymentSerializer
 
 
-class AdViewSet(viewsets.ModelViewSet):
+class AdViewSet(CatalogCacheMixin, EagerLoadingViewSetMixin, viewsets.ModelViewSet):
     queryset = Ad.objects.all()
     serializer_class = AdSerializer
+    cache_namespace = 'ads'
     http_method_names = ['get']
 
-class OrderReviewsView(viewsets.ModelViewSet):
+    @action(detail=False, methods=['get'])
+    def active(self, request):
+        region = request.query_params.get('region')
+        if not region and request.user.is_authenticated:
+            region = request.user.region
+
+        ads = [
+            {**ad, 'image': request.build_absolute_uri(ad['image']) if ad['image'] else None}
+            for ad in AdService.get_active_ads(region)
+        ]
+        return Response(ads)
+
+class OrderReviewsView(EagerLoadingViewSetMixin, viewsets.ModelViewSet):
     queryset = OrderReview.objects.all()
     serializer_class = OrderReviewSerializer
 
 
-class BoostViewSet(viewsets.ModelViewSet):
+class BoostViewSet(CatalogCacheMixin, EagerLoadingViewSetMixin, viewsets.ModelViewSet):
     queryset = Boost.objects.all()
     serializer_class = BoostSerializer
+    cache_namespace = 'boosts'
 
 
-class ServiceBoostViewSet(viewsets.ModelViewSet):
+class ServiceBoostViewSet(EagerLoadingViewSetMixin, viewsets.ModelViewSet):
     queryset = ServiceBoost.objects.all()
     serializer_class = ServiceBoostSerializer
 
-class VacancyBoostViewSet(viewsets.ModelViewSet):
+class VacancyBoostViewSet(EagerLoadingViewSetMixin, viewsets.ModelViewSet):
     queryset = VacancyBoost.objects.all()
     serializer_class = VacancyBoostSerializer
 
+class ChatRoomViewSet(viewsets.ReadOnlyModelViewSet):
+    serializer_class = ChatRoomSerializer
+    permission_classes = [IsAuthenticated]
+
+    def get_queryset(self):
+        return ChatRoom.for_user(self.request.user)
+
+    @action(detail=False, methods=['post'])
+    def direct(self, request):
+        """Find or create the caller's one-to-one room with `user_id`."""
+        try:
+            other = User.objects.only('id').get(pk=int(request.data.get('user_id')))
+            room = ChatRoom.get_direct(request.user.id, other.id)
+        except (TypeError, ValueError, User.DoesNotExist):
+            raise DRFValidationError({'user_id': 'Укажите другого пользователя'})
+        return Response(self.get_serializer(room).data)
+
+    @action(detail=False, methods=['get'], serializer_class=InboxSerializer)
+    def inbox(self, request):
+        """Every room of the caller with its last message and unread count, in one query."""
+        serializer = self.get_serializer(ChatRoom.inbox(request.user), many=True)
+        return Response(serializer.data)
+
+    @action(detail=True, methods=['get'], pagination_class=ChatHistoryPagination)
+    def messages(self, request, pk=None):
+        """Newest-first history; follow `next` to load older messages."""
+        room = self.get_object()
+        page = self.paginate_queryset(room.messages.all())
+        serializer = MessageSerializer(page, many=True, context=self.get_serializer_context())
+        return self.get_paginated_response(serializer.data)
+
+    @action(detail=True, methods=['post'])
+    def read(self, request, pk=None):
+        """Move the caller's read watermark to `message_id` and notify the room."""
+        room = self.get_object()
+        try:
+            message_id = int(request.data.get('message_id'))
+        except (TypeError, ValueError):
+            raise DRFValidationError({'message_id': 'Укажите id сообщения'})
+        if ChatMembership.mark_read(room.id, request.user.id, message_id):
+            async_to_sync(get_channel_layer().group_send)(
+                room.group_name,
+                {'type': 'read_receipt', 'user_id': request.user.id, 'last_read_message_id': message_id}
+            )
+        return Response({'unread_count': ChatMembership.unread_count(room.id, request.user.id)})
+
 # --- APIViews ---
 
 class RequestOTPView(GenericAPIView):
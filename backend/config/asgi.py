@@ -6,15 +6,19 @@ It exposes the ASGI callable as a module-level variable named ``application``.
 
 import os
 from django.core.asgi import get_asgi_application
-from channels.routing import ProtocolTypeRouter, URLRouter
-from channels.auth import AuthMiddlewareStack
-import api.routing
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
 
+# Load the app registry before importing consumers and their models
+django_asgi_app = get_asgi_application()
+
+from channels.routing import ProtocolTypeRouter, URLRouter  # noqa: E402
+import api.routing  # noqa: E402
+from api.middleware import JWTAuthMiddleware  # noqa: E402
+
 application = ProtocolTypeRouter({
-    "http": get_asgi_application(),
-    "websocket": AuthMiddlewareStack(
+    "http": django_asgi_app,
+    "websocket": JWTAuthMiddleware(
         URLRouter(
             api.routing.websocket_urlpatterns
         )
@@ -19,4 +19,6 @@ PAYME_ID = os.getenv("PAYME")
 PAYME_KEY = os.getenv("PAYME_KEY")
 
 BOT_SERVICE_URL = os.getenv("BOT_SERVICE_URL")
-BOT_SERVICE_TOKEN = os.getenv("BOT_SERVICE_TOKEN")
\ No newline at end of file
+BOT_SERVICE_TOKEN = os.getenv("BOT_SERVICE_TOKEN")
+
+REDIS_URL = os.getenv("REDIS_URL")
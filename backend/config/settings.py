@@ -17,7 +17,8 @@ from .env import (
     PAYME_ID,
     PAYME_KEY,
     BOT_SERVICE_URL,
-    BOT_SERVICE_TOKEN
+    BOT_SERVICE_TOKEN,
+    REDIS_URL,
 )
 
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -182,13 +183,32 @@ SIMPLE_JWT = {
     "UPDATE_LAST_LOGIN": True,
 }
 
-# Serverga Redis install qigandan keyin cache ni yoqib qo'yamiz
-# CACHES = {
-#     "default": {
-#         "BACKEND": "django.core.cache.backends.redis.RedisCache",
-#         "LOCATION": "redis://127.0.0.1:6379/1",
-#     }
-# }
+# REDIS_URL berilmasa har bir worker o'z local-memory cache'idan foydalanadi
+if REDIS_URL:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": REDIS_URL,
+        }
+    }
+else:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+            "LOCATION": "myprofy",
+        }
+    }
+
+# OTP codes live in the cache only when it is shared between workers
+OTP_STORAGE = (
+    "api.services.otp_storage.CacheOTPStorage" if REDIS_URL
+    else "api.services.otp_storage.DatabaseOTPStorage"
+)
+
+# Catalog endpoints (categories, subcategories, boosts, ads) are invalidated by version
+# bumps; versions and responses both expire after this TTL, so with the local-memory
+# backend other workers (and ETags they issued) see a bump at most this late.
+CATALOG_CACHE_TIMEOUT = 300
 
 CHANNEL_LAYERS = {
     'default': {
@@ -199,6 +219,23 @@ CHANNEL_LAYERS = {
     },
 }
 
+# Chat websockets authenticate with JWT access tokens; when set, the user's name is
+# also cached for this many seconds (0 trusts the token claims alone)
+CHAT_JWT_USER_CACHE_TTL = 60
+
+# ChatConsumer: messages saved within this many milliseconds are written with one
+# bulk_create per process; 0 saves each message as it arrives
+CHAT_WRITE_COALESCE_MS = 0
+
+# Chunked chat attachments (binary websocket frames); partial files and their metadata
+# are kept in CHAT_UPLOAD_TEMP_DIR, which must be shared by all chat workers, for
+# CHAT_UPLOAD_TTL seconds so an interrupted upload can resume
+CHAT_UPLOAD_MAX_SIZE = 20 * 1024 * 1024
+CHAT_UPLOAD_MAX_PENDING = 3  # unfinished uploads per user
+CHAT_UPLOAD_CHUNK_SIZE = 256 * 1024
+CHAT_UPLOAD_TTL = 24 * 60 * 60
+CHAT_UPLOAD_TEMP_DIR = BASE_DIR / 'tmp' / 'chat_uploads'
+
 STATICFILES_DIRS = [
     BASE_DIR / 'backend' / 'static',
 ]
@@ -268,6 +305,12 @@ ELASTICSEARCH_DSL = {
     },
 }
 
+# Saves only queue the changed objects; the search_sync worker
+# (flush_search_index --loop) indexes them in bulk once they have been quiet
+# for SEARCH_INDEX_DEBOUNCE seconds
+ELASTICSEARCH_DSL_SIGNAL_PROCESSOR = 'api.search.signals.QueuedSignalProcessor'
+SEARCH_INDEX_DEBOUNCE = 2
+
 BOT_NAME = "myprofy_bot"
 PHONENUMBER_DEFAULT_REGION = 'UZ'
 